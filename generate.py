@@ -1,9 +1,9 @@
 import bpy
 import os
 import sys
-import random
+import json
 from fnmatch import fnmatch
-import cv2
+import numpy as np
 
 dir = os.path.dirname(bpy.data.filepath)
 if not dir in sys.path:
@@ -13,6 +13,14 @@ from lib.cmdparser import parse
 from scenes.concretescene import ConcreteScene
 from scenes.concretescene_stereo import ConcreteSceneStereo
 from lib.rendermanager import RenderManager
+from lib.crackcache import CrackCache
+from lib.crackbank import CrackBank
+from lib.crackprefetcher import CrackPrefetcher
+from lib.texturecache import TextureCache
+from lib.memorymonitor import MemoryMonitor
+from lib.renderprofiles import load_render_profiles
+from lib.randomstreams import new_run_seed, sample_rng, crack_seed
+from lib.fractalcracks import adaptive_depth
 
 #TODO the GPU mode is experimental. We recommend using the CPUs.  
 #Find out if system has GPU and if it has at least one GPU, it is going to be set
@@ -26,10 +34,13 @@ if len(list(bpy.context.user_preferences.addons['cycles'].preferences.devices))
     UseGPU = True
 
 
-def run(num_images, n_concrete, args=None):
-    for i in range(num_images):
+def run(sample_ids, n_concrete, args=None, memory_monitor=None):
+    for iteration, i in enumerate(sample_ids):
+        # every image draws its random values from its own stream, so it can be rendered on its own
+        rng = sample_rng(run_seed, i)
+
         # randomly choose concrete texture map set
-        concrete = random.randint(0, n_concrete-1)
+        concrete = rng.randint(0, n_concrete)
 
         concrete_name = concrete_list[concrete].split('_Base_Color')
         # sample textures
@@ -44,50 +55,48 @@ def run(num_images, n_concrete, args=None):
        
         print("Load new texture to shader...")
         scene.shaderDict["concrete"].load_texture(albedoPath, roughnessPath, normalPath, heightPath)
-        scene.update()
+        scene.update(rng, crack_seed(run_seed, i))
         print("Done...")
 
         
+        # save images to folder
+        if not os.path.isdir("res"):
+            os.mkdir("res")
+
+        # set filenames for storing images, the render passes write them directly
+        outputs = {
+            'color': os.path.join('res/render' + str(i) + '.png'),
+            'normal': os.path.join('res/normal' + str(i) + '.png'),
+            'gt': os.path.join('res/gt' + str(i) + '.png'),
+            'depth': os.path.join('res/depth' + str(i) + '.' + args.depth_format),
+        }
+        outputs_right = {
+            'color': os.path.join('res/render' + str(i) + '_right.png'),
+            'normal': os.path.join('res/normal' + str(i) + '_right.png'),
+            'gt': os.path.join('res/gt' + str(i) + '_right.png'),
+            'depth': os.path.join('res/depth' + str(i) + '_right.' + args.depth_format),
+        }
+        crack_string = os.path.join('res/crack' + str(i) + '.json')
+
         print("Rendering...")
         if(args.stereo_camera):
             print("Rendering stereo...")
             renderManager.render_stereo(
                                 cameraLeft=bpy.data.objects['CameraLeft'], 
-                                cameraRight=bpy.data.objects['CameraRight']
+                                cameraRight=bpy.data.objects['CameraRight'],
+                                outputs=outputs,
+                                outputs_right=outputs_right
                                 )
         else:
             print("Rendering single...")
-            renderManager.render(camera=bpy.data.objects['Camera'])
+            renderManager.render(camera=bpy.data.objects['Camera'], outputs=outputs)
         print("Done...")
 
-        # save images to folder
-        if not os.path.isdir("res"):
-            os.mkdir("res")
-
-        # set filenames for storing images
-        res_string = os.path.join('res/render' + str(i) + '.png')
-        gt_string = os.path.join('res/gt' + str(i) + '.png')
-        normal_string = os.path.join('res/normal' + str(i) + '.png')
-
-        res_string_right = os.path.join('res/render' + str(i) + '_right.png')
-        gt_string_right = os.path.join('res/gt' + str(i) + '_right.png')
-        normal_string_right = os.path.join('res/normal' + str(i) + '_right.png')
-
-        # save images to file
-        cv2.imwrite(res_string, renderManager.result_imgs[-1])
-        print("image save done...")
-        cv2.imwrite(normal_string, renderManager.result_normals[-1])
-        print("normal map save done...")
-        cv2.imwrite(gt_string, renderManager.result_gt[-1])
-        print("ground truth save done...")
-        # save images for stereo setup        
-        if(args.stereo_camera):
-            cv2.imwrite(res_string_right, renderManager.result_imgs_right[-1])
-            print("image save done...")
-            cv2.imwrite(normal_string_right, renderManager.result_normals_right[-1])
-            print("normal map save done...")
-            cv2.imwrite(gt_string_right, renderManager.result_gt_right[-1])
-            print("ground truth save done...")
+        # meta data of the crack, e.g. the fractal depth it was generated with
+        if(args.crack):
+            with open(crack_string, 'w') as f:
+                json.dump(scene.shaderDict["concrete"].crack_maps.meta(), f)
+            print("crack meta data save done...")
 
         print("")
 
@@ -102,6 +111,9 @@ def run(num_images, n_concrete, args=None):
             del renderManager.result_gt_right[:]
             del renderManager.result_depth_right[:]
 
+        if memory_monitor is not None:
+            memory_monitor.record(iteration, sample_id=i)
+
 # parse command line arguments
 args = parse(sys.argv)
 print("Command line options:")
@@ -109,6 +121,28 @@ for arg in vars(args):
     print(arg, getattr(args, arg))
 
 
+# seed the random number generators, reruns with the same seed then reproduce the same images
+run_seed = args.seed
+if run_seed is None:
+    run_seed = new_run_seed()
+print("Run seed: " + str(run_seed))
+# the global state is only used for the scene setup, the images use per sample streams
+np.random.seed(run_seed)
+
+# the soak test renders many small images to find memory growth quickly
+if args.soak is not None:
+    args.resolution = args.soak_resolution
+    args.samples = 1
+    args.num_images = args.soak
+    args.sample_ids = None
+    if args.instrument is None:
+        args.instrument = os.path.join('res', 'memory.jsonl')
+
+if args.sample_ids is not None:
+    sample_ids = args.sample_ids
+else:
+    sample_ids = range(args.start_index, args.start_index + args.num_images)
+
 # if directory not found download from online for concrete maps
 assert os.path.isdir("concrete_textures"), "no concrete texture folder found"
 
@@ -151,20 +185,82 @@ print("Done...")
 # set samples to 1 for debugging. 6 to 10 samples are usually sufficient for visually pleasing render results
 print("Setting up scene...")
 # print args.crack
+crack_cache = None
+if args.crack_cache is not None:
+    print("Using crack map cache in " + args.crack_cache)
+    crack_cache = CrackCache(args.crack_cache, max_bytes=int(args.crack_cache_size * 1024**3))
+crack_bank = None
+if args.crack_bank is not None:
+    print("Sampling cracks from crack bank " + args.crack_bank)
+    crack_bank = CrackBank(args.crack_bank)
+texture_cache = TextureCache(max_bytes=int(args.texture_cache_size * 1024**3))
+crack_params = {'num_cracks': args.cracks_per_image, 'num_branches': args.crack_branches}
+crack_depth = args.crack_depth
+if crack_depth is None:
+    crack_depth = adaptive_depth(args.resolution, max_points=args.crack_max_points,
+                                 max_seconds=args.crack_time_budget,
+                                 num_polylines=args.cracks_per_image + args.crack_branches)
+if args.crack:
+    print("Crack fractal depth: " + str(crack_depth))
+    if args.crack_depth is None and args.crack_time_budget is not None:
+        # measured on this machine, other processes may pick another depth and generate other cracks for the same
+        # sample ids
+        print("The crack depth was calibrated to the time budget on this machine, pass --crack-depth " +
+              str(crack_depth) + " to workers rendering other parts of this run to get the same cracks")
+# the workers are forked here, before the scene is set up. a bank makes generation unnecessary.
+crack_prefetcher = None
+if args.crack and args.crack_workers > 0 and crack_bank is None:
+    print("Prefetching cracks with " + str(args.crack_workers) + " worker processes")
+    crack_prefetcher = CrackPrefetcher([crack_seed(run_seed, i) for i in sample_ids], args.resolution, crack_depth,
+                                       processes=args.crack_workers, queue_size=args.crack_queue_size,
+                                       crack_cache=crack_cache, **crack_params)
 if(args.stereo_camera):
     print("Using stereo camera scene setup..")
-    scene = ConcreteSceneStereo(args.resolution, args.crack, concrete_name)
+    scene = ConcreteSceneStereo(args.resolution, args.crack, concrete_name,
+                                crack_cache=crack_cache, crack_bank=crack_bank, crack_params=crack_params,
+                                crack_depth=crack_depth, crack_prefetcher=crack_prefetcher,
+                                texture_cache=texture_cache)
 else:
     print("Using single camera scene setup..")
-    scene = ConcreteScene(args.resolution, args.crack, concrete_name)
+    scene = ConcreteScene(args.resolution, args.crack, concrete_name,
+                          crack_cache=crack_cache, crack_bank=crack_bank, crack_params=crack_params,
+                          crack_depth=crack_depth, crack_prefetcher=crack_prefetcher,
+                          texture_cache=texture_cache)
 print("Done...")
 
 print("Init render manager...")
+render_profiles = None
+if args.render_profiles is not None:
+    render_profiles = load_render_profiles(args.render_profiles)
 renderManager = RenderManager(path="tmp/tmp.png", frames=1, samples=args.samples, tilesize=args.tile_size,
-                              resolution=args.resolution, cracked=args.crack)
+                              resolution=args.resolution, cracked=args.crack, single_pass=args.single_render,
+                              profiles=render_profiles, measure_savings=args.report_profile_savings,
+                              uv_lookup=args.uv_ground_truth, depth_format=args.depth_format)
 renderManager.setScene(scene)
 print("Done...")
 
+memory_monitor = None
+if args.instrument is not None:
+    print("Recording memory use to " + args.instrument)
+    if os.path.dirname(args.instrument) and not os.path.isdir(os.path.dirname(args.instrument)):
+        os.makedirs(os.path.dirname(args.instrument))
+    memory_monitor = MemoryMonitor(args.instrument)
+
 print("Rendering...")
-run(args.num_images, n_concrete, args)
+run(sample_ids, n_concrete, args, memory_monitor)
+if crack_prefetcher is not None:
+    crack_prefetcher.close()
 print("Done...")
+
+print("Render times per pass:")
+for line in renderManager.report_pass_times():
+    print("  " + line)
+
+if memory_monitor is not None:
+    memory_monitor.close()
+    if args.soak is not None:
+        growth = memory_monitor.rss_growth() / 1024.0**2
+        print("Soak test: RSS grew by {:.1f} MB over {} images".format(growth, args.soak))
+        if growth > args.soak_max_growth:
+            print("Soak test failed: more than {:.1f} MB growth".format(args.soak_max_growth))
+            sys.exit(1)
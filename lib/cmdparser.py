@@ -1,6 +1,10 @@
 # Adapted from
 # https://developer.blender.org/diffusion/B/browse/master/release/scripts/templates_py/background_job.py
 import argparse
+
+from lib.imagefiles import DEPTH_FORMATS
+
+
 def parse(argv):
 
     if "--" not in argv:
@@ -32,5 +36,66 @@ def parse(argv):
     					help="whether to use stereo camera setup")
     parser.add_argument("-dp", "--path", metavar="Path", default ="/concrete_textures",
                         help="path of your concrete dictionary")
+    parser.add_argument("--seed", default=None, type=int,
+                        metavar="SEED", help="run seed, every image gets its own random stream derived from the run "
+                                             "seed and its index (default: random, printed at start)")
+    parser.add_argument("--start-index", default=0, type=int, metavar="I",
+                        help="index of the first image, e.g. to split a run over several workers (default 0)")
+    parser.add_argument("--sample-ids", default=None, type=int, nargs="+", metavar="ID",
+                        help="render only the images with these indices, overrides --num-images and --start-index")
+    parser.add_argument("--cracks-per-image", default=1, type=int, metavar="K",
+                        help="number of independent cracks in every crack map (default 1)")
+    parser.add_argument("--crack-branches", default=0, type=int, metavar="B",
+                        help="number of branches off the cracks of every crack map (default 0)")
+    parser.add_argument("--crack-depth", default=None, type=int, metavar="D",
+                        help="fractal depth of the cracks (default: segments of about one pixel at the render "
+                             "resolution, capped by --crack-max-points and --crack-time-budget)")
+    parser.add_argument("--crack-max-points", default=None, type=int, metavar="P",
+                        help="maximum number of points of a crack map, caps the automatic depth (default: no cap)")
+    parser.add_argument("--crack-time-budget", default=None, type=float, metavar="SEC",
+                        help="time budget in seconds for the depth dependent part of generating a crack map, caps "
+                             "the automatic depth. the depth then depends on the speed of the machine: give workers "
+                             "splitting a run the depth printed by the first as --crack-depth (default: no cap)")
+    parser.add_argument("--crack-workers", default=0, type=int, metavar="N",
+                        help="number of worker processes generating the cracks of upcoming images while rendering, "
+                             "0 generates them in blender's process (default 0)")
+    parser.add_argument("--crack-queue-size", default=4, type=int, metavar="Q",
+                        help="maximum number of cracks generated ahead by the workers (default 4)")
+    parser.add_argument("--texture-cache-size", default=4.0, type=float, metavar="GB",
+                        help="memory budget in GB of concrete textures kept loaded for reuse (default 4)")
+    parser.add_argument("--crack-cache", default=None, metavar="Path",
+                        help="directory of an on-disk cache for generated crack maps (default: no cache)")
+    parser.add_argument("--crack-cache-size", default=10.0, type=float, metavar="GB",
+                        help="maximum size of the crack map cache in GB (default 10)")
+    parser.add_argument("--crack-bank", default=None, metavar="Path",
+                        help="crack bank file (see utils/build_crack_bank.py) to sample cracks from instead of "
+                             "generating them (default: no bank)")
+    parser.add_argument("--single-render", action='store_true', default=False,
+                        help="render color, normals and depth of a camera in one render job from the passes of one "
+                             "render layer, so the scene is synced once. the ground truth is rendered on its own "
+                             "unless --uv-ground-truth is given. compare a run with one without it before relying on "
+                             "it, see utils/compare_renders.py")
+    parser.add_argument("--uv-ground-truth", action='store_true', default=False,
+                        help="look the ground truth up at the texture coordinates of the color render instead of "
+                             "rendering it")
+    parser.add_argument("--depth-format", default='exr', choices=DEPTH_FORMATS,
+                        help="format of the depth maps: 32 bit OpenEXR as rendered, float16 .npy or .npz or 16 bit "
+                             "PNG with the scale in a .json file next to it (default: exr)")
+    parser.add_argument("--render-profiles", default=None, metavar="Path",
+                        help="JSON file with render quality settings per pass (color, normal, gt, depth), see "
+                             "lib/renderprofiles.py (default: --samples for color, no bounces for normals and ground "
+                             "truth, one sample for depth)")
+    parser.add_argument("--report-profile-savings", action='store_true', default=False,
+                        help="render every auxiliary pass once with the color settings to report the time saved")
+    parser.add_argument("--instrument", default=None, metavar="Path",
+                        help="record memory use and blender datablocks after every image as JSON lines into this "
+                             "file (default: off)")
+    parser.add_argument("--soak", default=None, type=int, metavar="N",
+                        help="memory soak test: render N images at --soak-resolution with one sample, instrumented, "
+                             "and fail if the memory grows by more than --soak-max-growth (default: off)")
+    parser.add_argument("--soak-resolution", default=256, type=int, metavar="R",
+                        help="render resolution of the soak test (default 256)")
+    parser.add_argument("--soak-max-growth", default=200.0, type=float, metavar="MB",
+                        help="maximum RSS growth in MB of the soak test after the first image (default 200)")
 
     return parser.parse_args(argv)
@@ -0,0 +1,88 @@
+import json
+import struct
+
+import numpy
+
+from lib.crackmaps import CrackMaps
+from lib.fractalcracks import generate_crack_maps
+from lib.randomstreams import new_run_seed, sample_rng
+
+# File layout of a crack bank:
+#   header  MAGIC, format version, byte offset and byte length of the index (struct HEADER_FORMAT)
+#   data    crack intensity and normal tiles of every crack, each array aligned to ALIGNMENT bytes
+#   index   json with the resolution of the bank and, per crack, dtype, shape and byte offset of both arrays
+#           plus the tile offset and generation meta data
+# The whole file is memory-mapped read-only, so several processes (e.g. blender workers mapping the same file in
+# /dev/shm) share the pages and CrackMaps returned by the bank are views into the mapping without any copy.
+MAGIC = b'CRACKBNK'
+VERSION = 1
+HEADER_FORMAT = '<8sQQQ'
+ALIGNMENT = 64
+
+
+def write_crack_bank(path, bank_size, resolution, depth, seed=None, **params):
+    # generates bank_size crack maps with generate_crack_maps(resolution, depth, **params) into a bank file.
+    # crack i is generated from the stream (seed, i), so every crack of a bank can be regenerated on its own.
+    if seed is None:
+        seed = new_run_seed()
+    header_size = struct.calcsize(HEADER_FORMAT)
+    entries = []
+
+    with open(path, 'wb') as f:
+        # place-holder header, rewritten once the index position is known
+        f.write(b'\0' * header_size)
+
+        for i in range(bank_size):
+            crack_maps = generate_crack_maps(resolution, depth, rng=sample_rng(seed, i), **params)
+            entry = crack_maps.meta()
+            for name, array in (('crack', crack_maps.crack), ('normals', crack_maps.normal_tile())):
+                f.write(b'\0' * (-f.tell() % ALIGNMENT))
+                entry[name] = {'position': f.tell(), 'shape': array.shape, 'dtype': array.dtype.str}
+                f.write(numpy.ascontiguousarray(array).tobytes())
+            entries.append(entry)
+
+            if (i + 1) % 100 == 0:
+                print("crack bank: " + str(i + 1) + "/" + str(bank_size) + " cracks generated")
+
+        index = json.dumps({'resolution': resolution, 'seed': seed, 'entries': entries}).encode('utf-8')
+        index_position = f.tell()
+        f.write(index)
+
+        f.seek(0)
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, index_position, len(index)))
+
+
+class CrackBank:
+    def __init__(self, path):
+        self.path = path
+        self._data = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+
+        header_size = struct.calcsize(HEADER_FORMAT)
+        magic, version, index_position, index_length = struct.unpack(HEADER_FORMAT,
+                                                                     self._data[:header_size].tobytes())
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path + " is not a crack bank of version " + str(VERSION))
+
+        index = json.loads(self._data[index_position:index_position + index_length].tobytes().decode('utf-8'))
+        self.resolution = index['resolution']
+        self._entries = index['entries']
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _array(self, description):
+        dtype = numpy.dtype(description['dtype'])
+        shape = tuple(description['shape'])
+        start = description['position']
+        stop = start + int(numpy.prod(shape)) * dtype.itemsize
+        return self._data[start:stop].view(dtype).reshape(shape)
+
+    def __getitem__(self, i):
+        entry = self._entries[i]
+        return CrackMaps(self._array(entry['crack']), self._array(entry['normals']), depth=entry['depth'],
+                         max_thickness=entry['max_thickness'], offset=entry['offset'], resolution=self.resolution)
+
+    def sample(self, rng=None):
+        if rng is None:
+            rng = numpy.random
+        return self[rng.randint(len(self))]
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy
+
+from lib.crackmaps import CrackMaps
+from lib.fractalcracks import GENERATOR_VERSION, generate_crack_maps
+
+
+class CrackCache:
+    # On-disk cache of generated crack maps. Every entry is a directory named after the hash of the generation
+    # parameters (seed, resolution, depth, the keyword arguments of generate_crack_maps and the generator version)
+    # and holds the compact maps as .npy files, from which ground truth, roughness, height and normal maps are
+    # expanded:
+    #   crack.npy    crack intensity tile
+    #   normals.npy  normal tile
+    #   meta.json    generation parameters, tile offset and resolution
+    # Hits are loaded memory-mapped. The modification time of meta.json is the last access time, once the cache
+    # grows beyond max_bytes the least recently used entries are removed. The entry just stored is always kept, even
+    # if it alone is larger than max_bytes.
+    def __init__(self, directory, max_bytes=10 * 1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    @staticmethod
+    def key(seed, resolution, depth, **params):
+        description = dict(params, seed=seed, resolution=resolution, depth=depth, version=GENERATOR_VERSION)
+        # dtypes and other numpy objects are hashed by their string representation
+        encoded = json.dumps(description, sort_keys=True, default=str)
+        return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def load(self, key):
+        # returns the cached CrackMaps or None
+        entry = self._entry(key)
+        meta_path = os.path.join(entry, 'meta.json')
+        if not os.path.isfile(meta_path):
+            return None
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        crack = numpy.load(os.path.join(entry, 'crack.npy'), mmap_mode='r')
+        normals = numpy.load(os.path.join(entry, 'normals.npy'), mmap_mode='r')
+
+        # mark as recently used
+        os.utime(meta_path, None)
+
+        return CrackMaps(crack, normals, depth=meta['depth'], max_thickness=meta['max_thickness'],
+                         offset=meta['offset'], resolution=meta['resolution'])
+
+    def store(self, key, crack_maps, **meta):
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return
+
+        # write into a temporary directory first, so other processes never see half written entries
+        tmp_entry = entry + '.tmp' + str(os.getpid())
+        os.makedirs(tmp_entry)
+        numpy.save(os.path.join(tmp_entry, 'crack.npy'), crack_maps.crack)
+        numpy.save(os.path.join(tmp_entry, 'normals.npy'), crack_maps.normal_tile())
+        meta.update(crack_maps.meta())
+        with open(os.path.join(tmp_entry, 'meta.json'), 'w') as f:
+            json.dump(meta, f, default=str)
+
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # another process stored the same entry in the meantime
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+        self.evict(keep=entry)
+
+    def get_or_generate(self, seed, resolution, depth, **params):
+        key = self.key(seed, resolution, depth, **params)
+        crack_maps = self.load(key)
+        if crack_maps is not None:
+            return crack_maps
+
+        # generate from the given seed with a stream of its own, the global random state is not touched
+        crack_maps = generate_crack_maps(resolution, depth, rng=numpy.random.RandomState(seed), **params)
+
+        self.store(key, crack_maps, seed=seed, params=params)
+        return crack_maps
+
+    def entries(self):
+        # (last access time, size in bytes, path) of all complete entries
+        entries = []
+        for name in os.listdir(self.directory):
+            if '.tmp' in name:
+                continue
+            entry = os.path.join(self.directory, name)
+            meta_path = os.path.join(entry, 'meta.json')
+            if not os.path.isfile(meta_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((os.path.getmtime(meta_path), size, entry))
+        return entries
+
+    def evict(self, keep=None):
+        # removes the least recently used entries except keep until the cache fits into max_bytes
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                if size > self.max_bytes:
+                    print("crack cache: an entry of " + str(size) + " bytes is larger than the cache size of " +
+                          str(self.max_bytes) + " bytes")
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
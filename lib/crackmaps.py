@@ -0,0 +1,210 @@
+import cv2
+import numpy
+
+# value of the normal map where the crack map is flat, i.e. everywhere outside of the crack
+BACKGROUND_NORMAL = (0.5, 0.5, 1.0)
+
+
+def intensity_max(dtype):
+    # maps stored as integers (masks) use their full range, float maps the 0-1 range blender expects
+    if numpy.issubdtype(dtype, numpy.integer):
+        return numpy.iinfo(dtype).max
+    return 1.0
+
+
+def _gradient(height, axis, out, scale):
+    # numpy.gradient along axis -2 or -1 (central differences, one-sided at the borders) times scale, computed in
+    # float32 straight into out
+    def index(start, stop):
+        if axis == -2:
+            return (Ellipsis, slice(start, stop), slice(None))
+        return (Ellipsis, slice(start, stop))
+
+    if height.shape[axis] < 2:
+        out[...] = 0
+        return
+    numpy.subtract(height[index(2, None)], height[index(None, -2)], out=out[index(1, -1)], dtype=numpy.float32)
+    out[index(1, -1)] *= 0.5 * scale
+    numpy.subtract(height[index(1, 2)], height[index(0, 1)], out=out[index(0, 1)], dtype=numpy.float32)
+    numpy.subtract(height[index(-1, None)], height[index(-2, -1)], out=out[index(-1, None)], dtype=numpy.float32)
+    out[index(0, 1)] *= scale
+    out[index(-1, None)] *= scale
+
+
+def normals_from_height(height, out=None, scale=1.0, dtype=numpy.float32):
+    # normal map of a height map (leading batch axes allowed), with the axis conventions of the original
+    # numpy.gradient based computation: channel 0 is the gradient along rows, channel 1 along columns, channel 2 the
+    # constant 1, normalized and biased to the 0-1 range. scale multiplies the heights, e.g. 255 for 0-1 maps.
+    # everything is computed in float32 on contiguous single channel arrays, each channel of out is written once.
+    # out can be a preallocated RGBA buffer, its alpha channel is then set to 1.
+    if out is None:
+        out = numpy.empty(height.shape + (3,), dtype=dtype)
+
+    # usually *-1, but given that we want the normals to point inside the surface it is omitted
+    normal_x = numpy.empty(height.shape, dtype=numpy.float32)
+    normal_y = numpy.empty(height.shape, dtype=numpy.float32)
+    _gradient(height, -2, normal_x, scale)
+    _gradient(height, -1, normal_y, scale)
+
+    # 0.5 / length, so normalization and the bias from -1,1 to the 0-1 range are one multiply-add per channel
+    half_inverse_length = numpy.square(normal_x)
+    half_inverse_length += numpy.square(normal_y)
+    half_inverse_length += 1
+    numpy.sqrt(half_inverse_length, out=half_inverse_length)
+    numpy.divide(0.5, half_inverse_length, out=half_inverse_length)
+
+    normal_x *= half_inverse_length
+    normal_x += 0.5
+    out[..., 0] = normal_x
+    normal_y *= half_inverse_length
+    normal_y += 0.5
+    out[..., 1] = normal_y
+    half_inverse_length += 0.5
+    out[..., 2] = half_inverse_length
+
+    if out.shape[-1] == 4:
+        out[..., 3] = 1
+    return out
+
+
+class CrackMaps:
+    # Compact representation of the maps of one crack. Only the single channel crack intensity and the three
+    # normal channels are stored, all other maps are views of these or derived on demand:
+    #   height       = crack intensity
+    #   ground truth = inverted crack intensity (crack is black, background white)
+    #   roughness    = ground truth (same buffer)
+    # RGBA arrays as blender expects them are only built by to_rgba, right before they are handed to blender.
+    #
+    # crack and normals can be a tile covering only the crack's bounding box. offset is the (row, column) of the
+    # tile inside the resolution x resolution map, everything outside of the tile is background.
+    # normals can be None, they are then computed from the crack when needed, by to_rgba directly into its buffer.
+    MAP_NAMES = ('ground_truth', 'roughness', 'normals', 'height')
+
+    def __init__(self, crack, normals, depth=None, max_thickness=1, offset=(0, 0), resolution=None):
+        self.crack = crack
+        self.normals = normals
+        self.offset = tuple(int(o) for o in offset)
+        self.resolution = crack.shape[0] if resolution is None else resolution
+
+        # meta data of the generation
+        self.depth = depth
+        self.max_thickness = max_thickness
+
+        self._ground_truth = None
+
+    @property
+    def is_sparse(self):
+        return self.crack.shape != (self.resolution, self.resolution)
+
+    @property
+    def tile(self):
+        # slices of the stored tile inside the full map
+        return (slice(self.offset[0], self.offset[0] + self.crack.shape[0]),
+                slice(self.offset[1], self.offset[1] + self.crack.shape[1]))
+
+    @property
+    def normal_scale(self):
+        # normals are computed on the 0-255 range of the crack intensities
+        return 255.0 / intensity_max(self.crack.dtype)
+
+    @property
+    def nbytes(self):
+        nbytes = self.crack.nbytes
+        if self.normals is not None:
+            nbytes += self.normals.nbytes
+        if self._ground_truth is not None:
+            nbytes += self._ground_truth.nbytes
+        return nbytes
+
+    def meta(self):
+        # generation meta data, as recorded with cached and banked cracks and next to rendered images
+        return {'depth': self.depth, 'max_thickness': self.max_thickness, 'offset': self.offset,
+                'resolution': self.resolution}
+
+    def normal_tile(self):
+        # stored normals of the tile, computed if there are none
+        if self.normals is None:
+            return normals_from_height(self.crack, scale=self.normal_scale)
+        return self.normals
+
+    def densify(self):
+        # returns CrackMaps holding full resolution arrays, self if they already are
+        if not self.is_sparse and self.normals is not None:
+            return self
+        crack = numpy.zeros((self.resolution, self.resolution), dtype=self.crack.dtype)
+        crack[self.tile] = self.crack
+        normal_tile = self.normal_tile()
+        normals = numpy.empty((self.resolution, self.resolution, 3), dtype=normal_tile.dtype)
+        normals[:] = BACKGROUND_NORMAL
+        normals[self.tile] = normal_tile
+        return CrackMaps(crack, normals, depth=self.depth, max_thickness=self.max_thickness)
+
+    def height(self):
+        return self.densify().crack
+
+    def ground_truth(self):
+        # invert the matrix so the crack is black and the background is white. computed once, shared with roughness
+        if self._ground_truth is None:
+            self._ground_truth = intensity_max(self.crack.dtype) - self.height()
+        return self._ground_truth
+
+    def roughness(self):
+        return self.ground_truth()
+
+    def get(self, name):
+        if name == 'normals':
+            return self.densify().normals
+        return getattr(self, name)()
+
+    def lookup(self, uv):
+        # crack intensity in the 0-1 range (0 outside of the crack) at the texture coordinates uv, a (height, width, 2)
+        # array of u and v per image pixel. interpolated bilinearly like blender's image texture node, whose pixel
+        # rows run from v = 0 upwards like the rows of the crack arrays. only the stored tile is read, everything
+        # outside of it is background.
+        map_x = uv[..., 0] * self.resolution - (0.5 + self.offset[1])
+        map_y = uv[..., 1] * self.resolution - (0.5 + self.offset[0])
+        crack = cv2.remap(self.crack.astype(numpy.float32), map_x.astype(numpy.float32), map_y.astype(numpy.float32),
+                          cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        crack *= 1.0 / intensity_max(self.crack.dtype)
+        return crack
+
+    def to_rgba(self, name, out=None, dtype=numpy.float32):
+        # expands a map to a (W, W, 4) array in the 0-1 range. out can be a preallocated RGBA buffer.
+        # the background is filled once, only the tile is written from the stored arrays.
+        if out is None:
+            out = numpy.empty((self.resolution, self.resolution, 4), dtype=dtype)
+        tile = out[self.tile]
+
+        if name == 'normals':
+            if self.is_sparse:
+                out[..., 0:3] = BACKGROUND_NORMAL
+            if self.normals is None:
+                normals_from_height(self.crack, out=tile[..., 0:3], scale=self.normal_scale)
+            else:
+                tile[..., 0:3] = self.normals
+            out[..., 3] = 1
+            return out
+
+        # the crack intensity is used as alpha channel for all grayscale maps
+        if self.is_sparse:
+            out[..., 3] = 0
+        scale = 1.0 / intensity_max(self.crack.dtype)
+        tile[..., 3] = self.crack
+        if scale != 1.0:
+            tile[..., 3] *= scale
+        if name == 'height':
+            out[..., 0:3] = out[..., 3:4]
+        elif name in ('ground_truth', 'roughness'):
+            out[..., 0:3] = 1 - out[..., 3:4]
+        else:
+            raise ValueError("unknown crack map: " + str(name))
+        return out
+
+    def as_tuple(self):
+        # legacy layout of generate_fractal_cracks: ground truth, roughness, normal and height maps with a trailing
+        # channel axis, RGBA for the grayscale maps and RGB for the normals
+        dense = self.densify()
+        height = numpy.repeat(dense.crack[..., numpy.newaxis], 4, axis=-1)
+        ground_truth = numpy.copy(height)
+        ground_truth[..., 0:3] = intensity_max(self.crack.dtype) - ground_truth[..., 0:3]
+        return ground_truth, ground_truth, dense.normals, height
@@ -0,0 +1,84 @@
+import collections
+import multiprocessing
+
+import numpy
+
+from lib.fractalcracks import generate_crack_maps
+
+
+def generate_crack_maps_for_seed(seed, resolution, depth, crack_cache=None, **params):
+    # the crack maps of a sample's crack seed, the same whether CrackShader generates them or a prefetch worker does
+    if crack_cache is not None:
+        return crack_cache.get_or_generate(seed, resolution, depth, **params)
+    # normals are not stored, they are computed when the maps are expanded for blender
+    return generate_crack_maps(resolution, depth, normals=False, rng=numpy.random.RandomState(seed), **params)
+
+
+def _prefetch(seed, resolution, depth, crack_cache, params):
+    # runs in a worker process, so the normals are computed here too instead of in blender's process
+    crack_maps = generate_crack_maps_for_seed(seed, resolution, depth, crack_cache, **params)
+    if crack_maps.normals is None:
+        crack_maps.normals = crack_maps.normal_tile()
+    return crack_maps
+
+
+class CrackPrefetcher:
+    # Generates the crack maps of upcoming samples in a pool of worker processes while blender renders, so crack
+    # generation is off the critical path. seeds are the crack seeds of the samples in render order (see
+    # crack_seed in lib/randomstreams.py). At most queue_size cracks are generated ahead, which bounds the memory held
+    # by finished but not yet rendered cracks.
+    # The pool is forked on construction, so create the prefetcher before blender's scene is set up to keep the
+    # workers small. Workers never touch bpy.
+    def __init__(self, seeds, resolution, depth, processes=None, queue_size=4, crack_cache=None, **params):
+        self.resolution = resolution
+        self.depth = depth
+        self.queue_size = queue_size
+        self.crack_cache = crack_cache
+        self.params = params
+
+        self._seeds = list(seeds)
+        # index into _seeds of the next crack to prefetch
+        self._next = 0
+        # (seed, AsyncResult) of the cracks in generation or ready, in render order
+        self._pending = collections.deque()
+        self._pool = multiprocessing.Pool(processes)
+        self._fill()
+
+    def _fill(self):
+        while len(self._pending) < self.queue_size and self._next < len(self._seeds):
+            seed = self._seeds[self._next]
+            self._next += 1
+            result = self._pool.apply_async(_prefetch, (seed, self.resolution, self.depth, self.crack_cache,
+                                                         self.params))
+            self._pending.append((seed, result))
+
+    def get(self, seed):
+        # the CrackMaps of seed, waiting for it if it is not ready yet. cracks prefetched for seeds before it are
+        # dropped (skipped samples) and prefetching continues after it. None if seed is not an upcoming seed, the
+        # caller then generates it itself.
+        pending_seeds = [pending_seed for pending_seed, _ in self._pending]
+        if seed in pending_seeds:
+            skipped = pending_seeds.index(seed)
+        elif seed in self._seeds[self._next:]:
+            # further ahead than the queue: restart prefetching after it
+            skipped = len(self._pending)
+            self._next = self._seeds.index(seed, self._next) + 1
+        else:
+            print("crack prefetcher: seed " + str(seed) + " was not prefetched, generating it")
+            return None
+
+        if skipped:
+            print("crack prefetcher: dropping " + str(skipped) + " prefetched cracks of skipped samples")
+        for _ in range(skipped):
+            self._pending.popleft()
+        if self._pending and self._pending[0][0] == seed:
+            _, result = self._pending.popleft()
+            self._fill()
+            return result.get()
+        self._fill()
+        print("crack prefetcher: seed " + str(seed) + " was not prefetched yet, generating it")
+        return None
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
@@ -3,15 +3,42 @@ import bpy
 import numpy as np
 
 from lib.mastershader import MasterShader
-from lib.fractalcracks import generate_fractal_cracks
+from lib.fractalcracks import adaptive_depth
+from lib.crackprefetcher import generate_crack_maps_for_seed
+from lib.imageupload import upload_pixels
+from lib.datablocks import purge_orphan_images
+from lib.randomstreams import draw_seed
 
 class CrackShader(MasterShader):
+    # names of the ground truth, roughness, normal and height crack images. they are allocated once and
+    # overwritten in place on every update.
+    CRACK_IMAGE_NAMES = ("albedo_image", "roughness_image", "normals_image", "heights_image")
+
     def __init__(self, material_name, albedo_tex_path, roughness_tex_path, normal_tex_path,
-                 height_tex_path, resolution):
+                 height_tex_path, resolution, crack_cache=None, crack_bank=None, crack_params=None,
+                 crack_depth=None, crack_prefetcher=None, texture_cache=None):
         super(CrackShader, self).__init__(material_name, albedo_tex_path, roughness_tex_path,
-                                          normal_tex_path, height_tex_path)
+                                          normal_tex_path, height_tex_path, texture_cache)
 
         self.resolution = resolution
+        # compact maps of the current crack, see lib/crackmaps.py
+        self.crack_maps = None
+        # keyword arguments of generate_crack_maps, e.g. num_cracks and num_branches of crack networks
+        self.crack_params = {} if crack_params is None else crack_params
+        # fractal depth of generated cracks, by default segments of about one pixel at the render resolution
+        if crack_depth is None:
+            num_polylines = self.crack_params.get('num_cracks', 1) + self.crack_params.get('num_branches', 0)
+            crack_depth = adaptive_depth(self.resolution, num_polylines=num_polylines)
+        self.crack_depth = crack_depth
+        # optional CrackCache, cracks are then generated from a seed drawn per sample and reused across runs
+        self.crack_cache = crack_cache
+        # optional CrackBank, cracks are then sampled from the pre-generated bank and never generated here
+        self.crack_bank = crack_bank
+        # optional CrackPrefetcher generating the cracks of upcoming samples in worker processes
+        self.crack_prefetcher = crack_prefetcher
+        if self.crack_bank is not None and self.crack_bank.resolution != self.resolution:
+            raise ValueError("crack bank resolution " + str(self.crack_bank.resolution) +
+                             " does not match the render resolution " + str(self.resolution))
 
         self._setup()
 
@@ -74,39 +101,54 @@ class CrackShader(MasterShader):
         self._nodetree.links.new(self._nodes['normalmapconcrete'].outputs[0], self._nodes['pbr'].inputs['Normal'])
         self._nodetree.links.new(self._nodes['pbr'].outputs[0], self._nodes['Material Output'].inputs['Surface'])
 
-    def _generate_fractal_crack_maps(self):
-        generated_maps = []
+    def _generate_fractal_crack_maps(self, rng=None, seed=None):
         # generate crack maps
-        # TODO: uncomment below line and comment line after if fractal crack generation code is parallelized in GPU
-        # fractal_depth = int(np.log2(self.resolution) + 1)
-        # TODO: hardcoded
-        fractal_depth = 7
-        generated_maps[0:3] = (generate_fractal_cracks(self.resolution, fractal_depth))
-        # order is: ground truth, roughness, normals and height map
-        # for each map check whether it already has an alpha channel, i.e. the albedo map should have one
-        # for all other maps add an alpha channel that is filled with ones
-        for i in range(0, len(generated_maps)):
-            # last shape index is amount of color channels
-            if generated_maps[i].shape[-1] != 4:
-                tmp = np.zeros((generated_maps[i].shape[0], generated_maps[i].shape[1], 4))  # place-holder
-                tmp[:, :, 0:3] = generated_maps[i]  # copy old 3 channels
-                tmp[:, :, 3] = 1  # fill 4. alpha channel
-                generated_maps[i] = tmp  # copy back
-
-        # initialize empty texture structures of corresponding size
-        img_tex_albedo = bpy.data.images.new("albedo_image", width=self.resolution, height=self.resolution)
-        img_tex_roughness = bpy.data.images.new("roughness_image", width=self.resolution, height=self.resolution)
-        img_tex_normals = bpy.data.images.new("normals_image", width=self.resolution, height=self.resolution)
-        img_tex_heights = bpy.data.images.new("heights_image", width=self.resolution, height=self.resolution)
-
-        # flatten the arrays and assign them to the place-holder textures
-        img_tex_albedo.pixels = generated_maps[0].flatten().tolist()
-        img_tex_roughness.pixels = generated_maps[1].flatten().tolist()
-        img_tex_normals.pixels = generated_maps[2].flatten().tolist()
-        img_tex_heights.pixels = generated_maps[3].flatten().tolist()
+        fractal_depth = self.crack_depth
+        # the crack has its own stream seeded with seed (by default drawn from the sample's rng), so the same sample
+        # gets the same crack whether it is generated here, prefetched or loaded from the cache
+        if seed is None:
+            seed = draw_seed(rng)
+        if self.crack_bank is not None:
+            self.crack_maps = self.crack_bank.sample(np.random.RandomState(seed))
+        else:
+            self.crack_maps = None
+            if self.crack_prefetcher is not None:
+                self.crack_maps = self.crack_prefetcher.get(seed)
+            if self.crack_maps is None:
+                # without a cache normals are not stored, they are computed straight into the RGBA buffer below
+                self.crack_maps = generate_crack_maps_for_seed(seed, self.resolution, fractal_depth,
+                                                               self.crack_cache, **self.crack_params)
+
+        img_tex_albedo, img_tex_roughness, img_tex_normals, img_tex_heights = self._crack_images()
+
+        # order is: ground truth, roughness, normals and height map. the compact maps are expanded to RGBA
+        # only here, one at a time, and the RGBA buffer is reused for all of them.
+        rgba = np.empty((self.resolution, self.resolution, 4), dtype=np.float32)
+        for image, name in zip((img_tex_albedo, img_tex_roughness, img_tex_normals, img_tex_heights),
+                               self.crack_maps.MAP_NAMES):
+            # move the array into the place-holder texture without building python lists, see lib/imageupload.py
+            upload_pixels(image, self.crack_maps.to_rgba(name, out=rgba))
 
         return img_tex_albedo, img_tex_roughness, img_tex_normals, img_tex_heights
 
+    def _crack_images(self):
+        # the crack images at the current resolution, created only if they do not exist yet
+        images = []
+        for name in self.CRACK_IMAGE_NAMES:
+            image = bpy.data.images.get(name)
+            if image is not None and (tuple(image.size) != (self.resolution, self.resolution) or image.depth != 32):
+                bpy.data.images.remove(image, do_unlink=True)
+                image = None
+            if image is None:
+                # the crack intensity is the alpha channel of the grayscale maps, see CrackMaps.to_rgba. the shader
+                # relies on it: the ground truth emission is black wherever the alpha is 0.
+                image = bpy.data.images.new(name, width=self.resolution, height=self.resolution, alpha=True)
+                # new images have no users until they are linked to their nodes, the fake user keeps them through
+                # purges in the meantime
+                image.use_fake_user = True
+            images.append(image)
+        return images
+
     def set_shader_mode_gt(self):
         self._nodetree.links.new(self._nodes['emit1'].inputs['Color'], self._nodes['albedocrack'].outputs['Color'])
         self._nodetree.links.new(self._nodes['emit1'].outputs['Emission'],
@@ -143,37 +185,30 @@ class CrackShader(MasterShader):
         self._nodetree.links.new(self._nodes['normalconcrete'].outputs['Color'], self._nodes['normalmapconcrete'].inputs[1])
         self._nodetree.links.new(self._nodes['pbr'].outputs[0], self._nodes['Material Output'].inputs['Surface'])
 
-    def _load_images_to_textures_nodes(self):
-        img_tex_albedo, img_tex_roughness, img_tex_normals, img_tex_heights = self._generate_fractal_crack_maps()
+    # Override(MasterShader)
+    def _normal_map_color(self):
+        return self._nodes['normalmix'].outputs['Color']
+
+    def _load_images_to_textures_nodes(self, rng=None, crack_seed=None):
+        img_tex_albedo, img_tex_roughness, img_tex_normals, img_tex_heights = \
+            self._generate_fractal_crack_maps(rng, crack_seed)
 
         # feed new texture into appropriate nodes
         self._nodes['albedocrack'].image = img_tex_albedo
         self._nodes['roughnesscrack'].image = img_tex_roughness
         self._nodes['normalcrack'].image = img_tex_normals
         self._nodes['heightcrack'].image = img_tex_heights
-        # albedo map
-        bpy.data.images.load(filepath=self.albedoTexPath)
-        self._nodes['albedoconcrete'].image = bpy.data.images[self.albedoTexPath.split("/")[-1]]
-
-        # roughness map
-        bpy.data.images.load(filepath=self.roughnessTexPath)
-        self._nodes['roughnessconcrete'].image = bpy.data.images[self.roughnessTexPath.split("/")[-1]]
-
-        # normal map
-        bpy.data.images.load(filepath=self.normalTexPath)
-        self._nodes['normalconcrete'].image = bpy.data.images[self.normalTexPath.split("/")[-1]]
-
-        # height map
-        # TODO: This needs to go into the displacement modifier of the mesh!!!
-        bpy.data.images.load(filepath=self.heightTexPath)
-        # TODO: Height tex path being assigned to an image in a improper way. Needs to be fixed.
-        self._nodes['heightconcrete'].image = bpy.data.images[self.heightTexPath.split("/")[-1]]
-        # TODO: returning height texture path so that it can be used for displacement of mesh. This is an imroper fix.
-        #img_tex_albedo, img_tex_roughness, img_tex_normals, img_tex_heights = self._generate_fractal_crack_maps()
-        return self.heightTexPath.split("/")[-1], img_tex_heights
+
+        # concrete maps, see MasterShader
+        # TODO: returning height texture name so that it can be used for displacement of mesh. This is an imroper fix.
+        height_texture_name = super(CrackShader, self)._load_images_to_textures_nodes()
+
+        # images replaced since the last update, e.g. reloaded concrete textures, once all nodes are linked
+        purge_orphan_images()
+        return height_texture_name, img_tex_heights
 
     # Override(MasterShader)
-    def sample_texture(self):
+    def sample_texture(self, rng=None, crack_seed=None):
         # TODO: returning height texture path so that it can be used for displacement of mesh. This is an imroper fix.
-        heightTexturePath, img_tex_heights = self._load_images_to_textures_nodes()
+        heightTexturePath, img_tex_heights = self._load_images_to_textures_nodes(rng, crack_seed)
         return heightTexturePath, img_tex_heights
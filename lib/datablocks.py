@@ -0,0 +1,11 @@
+import bpy
+
+
+def purge_orphan_images():
+    # removes image datablocks nothing uses any more (e.g. replaced textures), which blender would otherwise keep
+    # in memory until the file is saved and reloaded. render results and the compositor's viewer image are left alone.
+    # returns the number of removed images.
+    orphans = [image for image in bpy.data.images if image.users == 0 and image.type == 'IMAGE']
+    for image in orphans:
+        bpy.data.images.remove(image, do_unlink=True)
+    return len(orphans)
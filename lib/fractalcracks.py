@@ -1,110 +1,308 @@
 import numpy
 import math
+import time
 import cv2
 
-def kochenize(first_p, second_p, i):
+from lib.crackmaps import CrackMaps, intensity_max, normals_from_height
+
+# gaussian kernel sizes used by widen_line, need to be odd
+BLUR_SCALES = (3, 5)
+
+# mean growth of the length of a crack per koch level, measured over many cracks. a crack of depth d spanning W
+# pixels is about W * KOCH_LENGTH_GROWTH**d pixels long and made of 4**d segments.
+KOCH_LENGTH_GROWTH = 1.04
+# depth at which the cost per crack point is measured for time budgets, see crack_seconds_per_point
+CALIBRATION_DEPTH = 6
+# version of the generated pixels, part of the crack cache keys. increased whenever the same parameters produce
+# different maps, e.g. when the rasterization changes.
+GENERATOR_VERSION = 2
+
+# All random draws go through an rng argument, a numpy.random.RandomState (see lib/randomstreams.py).
+# Without one, the global numpy.random state is used.
+
+def kochenize(first_p, second_p, i, rng=None):
+    p1, p2, p3 = kochenize_segments(numpy.asarray(first_p, dtype=float)[numpy.newaxis],
+                                    numpy.asarray(second_p, dtype=float)[numpy.newaxis], rng)
+    return tuple(p1[0]), tuple(p2[0]), tuple(p3[0])
+
+
+def truncated_normal(mu, sigma, low, high, size, rng=None):
+    # vectorized version of the rejection loop: draw all samples at once and only re-draw the rejected ones
+    if rng is None:
+        rng = numpy.random
+    samples = rng.normal(mu, sigma, size)
+    rejected = (samples < low) | (samples > high)
+    while numpy.any(rejected):
+        samples[rejected] = rng.normal(mu, sigma, numpy.count_nonzero(rejected))
+        rejected = (samples < low) | (samples > high)
+    return samples
+
+
+def kochenize_segments(first_p, second_p, rng=None):
+    # first_p and second_p are (..., 2) arrays holding start and end points of all segments of a level
+    if rng is None:
+        rng = numpy.random
     mu = 0.0
     sigma = numpy.pi/6.0 # 45°
 
-    angle_check = False
-    while angle_check == False:
-        theta = numpy.random.normal(mu, sigma)
-        if theta >= (-1.0 * numpy.pi / 4.0) and theta <= numpy.pi / 4.0:
-            angle_check = True
+    shape = first_p.shape[:-1]
+    theta = truncated_normal(mu, sigma, -1.0 * numpy.pi / 4.0, numpy.pi / 4.0, shape, rng)
 
-    dist_x = second_p[0] - first_p[0]
-    dist_y = second_p[1] - first_p[1]
+    dist_x = second_p[..., 0] - first_p[..., 0]
+    dist_y = second_p[..., 1] - first_p[..., 1]
 
-    randomsplit_x = numpy.random.uniform(2,6)
-    randomsplit_y = numpy.random.uniform(2,6)
-    p1 = (first_p[0] + dist_x / randomsplit_x, first_p[1] + dist_y / randomsplit_y)
-    p3 = (second_p[0] - dist_x / randomsplit_x, second_p[1] - dist_y / randomsplit_y)
+    randomsplit_x = rng.uniform(2, 6, shape)
+    randomsplit_y = rng.uniform(2, 6, shape)
+    p1 = numpy.stack((first_p[..., 0] + dist_x / randomsplit_x, first_p[..., 1] + dist_y / randomsplit_y), -1)
+    p3 = numpy.stack((second_p[..., 0] - dist_x / randomsplit_x, second_p[..., 1] - dist_y / randomsplit_y), -1)
 
-    d = numpy.sqrt(pow(dist_x, 2.0) + pow(dist_y, 2.0))
+    d = numpy.sqrt(dist_x ** 2 + dist_y ** 2)
     h = (d / 6) * numpy.tan(theta)
 
-    p2 = (first_p[0] + dist_x / 2.0 + h * (second_p[1] - first_p[1]) / d,
-          first_p[1] + dist_y / 2.0 - h * (second_p[0] - first_p[0]) / d)
+    p2 = numpy.stack((first_p[..., 0] + dist_x / 2.0 + h * dist_y / d,
+                      first_p[..., 1] + dist_y / 2.0 - h * dist_x / d), -1)
 
     return p1, p2, p3
 
 
-def koch(depth, width):
-    numlines = 4**depth + 1
+def koch(depth, width, rng=None):
+    return koch_batch(1, depth, width, rng)[0]
 
-    points = numpy.zeros((numlines, 2), dtype=float)
-    points[0] = (-width/2., numpy.random.uniform(0.0, 0.5*width))
-    points[-1] = (width/2., numpy.random.uniform(0.0, 0.5*width))
-    stepwidth = numlines - 1
-
-    for n in range(depth):
-        segment = int((numlines-1)/stepwidth)
-        for s in range(segment):
-            st = s*stepwidth
-            a = (points[st][0], points[st][1])
-            b = (points[st+stepwidth][0], points[st+stepwidth][1])
-            n1 = st + stepwidth//4
-            n2 = st + 2*stepwidth//4
-            n3 = st + 3*(stepwidth//4)
-            points[n1], points[n2], points[n3] = kochenize(a,b, depth)
-
-        stepwidth /= 4
-        stepwidth = int(stepwidth)
-    return points
-
-
-def random_rotate(img):
-    cols, rows = img.shape
-    RandomAngle = numpy.random.uniform(0, 180, 1)
-    MRot = cv2.getRotationMatrix2D((cols / 2, rows / 2), RandomAngle, 1)
-    img = cv2.warpAffine(img, MRot, (cols, rows))
-
-    return img
-
-
-def random_translate(img, TOTALWIDTH):
-    cols, rows = img.shape
-    RandomTranslation = numpy.random.uniform(-TOTALWIDTH / 2, TOTALWIDTH / 2)
-    MTrans = numpy.float32([[1, 0, RandomTranslation], [0, 1, RandomTranslation]])
-    img = cv2.warpAffine(img, MTrans, (cols, rows))
-
-    return img
 
+def koch_batch(num_cracks, depth, width, rng=None):
+    if rng is None:
+        rng = numpy.random
+    points = numpy.zeros((num_cracks, 2, 2), dtype=float)
+    points[:, 0, 0] = -width/2.
+    points[:, 0, 1] = rng.uniform(0.0, 0.5*width, num_cracks)
+    points[:, -1, 0] = width/2.
+    points[:, -1, 1] = rng.uniform(0.0, 0.5*width, num_cracks)
 
-def calculate_normals(img):
-    # make sure to convert image to float otherwise numpy clips gradient to positive values.
-    Grad = numpy.gradient(img.astype(float))
-    # numpy gradient has y,x indexing
-    GradX = Grad[0]
-    GradY = Grad[1]
-
-    # usually *-1, but given that we want the normals to point inside the surface it is omitted
-    NormX = GradX
-    NormY = GradY
-    NormZ = 1
-
-    length = numpy.sqrt(NormX ** 2 + NormY ** 2 + NormZ ** 2)
-    NormX = NormX / length
-    NormY = NormY / length
-    NormZ = NormZ / length
-
-    Normals = numpy.concatenate([NormX[:, :, numpy.newaxis], NormY[:, :, numpy.newaxis], NormZ[:, :, numpy.newaxis]], 2)
-    Normals = Normals * 0.5 + 0.5
+    # every level replaces each segment a-b by the four segments a-p1-p2-p3-b, all segments of all cracks at once
+    for n in range(depth):
+        p1, p2, p3 = kochenize_segments(points[:, :-1], points[:, 1:], rng)
+        subdivided = numpy.empty((num_cracks, 4 * (points.shape[1] - 1) + 1, 2), dtype=float)
+        subdivided[:, 0::4] = points
+        subdivided[:, 1::4] = p1
+        subdivided[:, 2::4] = p2
+        subdivided[:, 3::4] = p3
+        points = subdivided
 
-    return Normals
+    return points
 
 
-def widen_line(img):
-    Blur_scales = numpy.array((3, 5))  # need to be odd
-    Random_Blur = Blur_scales[numpy.random.randint(0, len(Blur_scales))]
+def random_rotate(pixels, TOTALWIDTH, rng=None):
+    # rotates the (num_cracks, num_points, 2) pixel coordinates of every crack by its own random angle around
+    # the canvas center. this is the point-space equivalent of cv2.getRotationMatrix2D + cv2.warpAffine.
+    if rng is None:
+        rng = numpy.random
+    RandomAngle = numpy.radians(rng.uniform(0, 180, pixels.shape[0]))
+    cos = numpy.cos(RandomAngle)[:, numpy.newaxis]
+    sin = numpy.sin(RandomAngle)[:, numpy.newaxis]
+    center = TOTALWIDTH / 2.
+
+    x = pixels[..., 0] - center
+    y = pixels[..., 1] - center
+    rotated = numpy.empty_like(pixels)
+    rotated[..., 0] = center + cos * x + sin * y
+    rotated[..., 1] = center - sin * x + cos * y
+
+    return rotated
+
+
+def random_translate(pixels, TOTALWIDTH, rng=None):
+    # shifts every crack diagonally by its own random offset
+    if rng is None:
+        rng = numpy.random
+    RandomTranslation = rng.uniform(-TOTALWIDTH / 2, TOTALWIDTH / 2, pixels.shape[0])
+    pixels = pixels + RandomTranslation[:, numpy.newaxis, numpy.newaxis]
+
+    return pixels
+
+
+def branch_off(parents, branch_points, rng=None):
+    # places koch points (num_branches, num_points, 2) as branches of the (num_parents, num_points, 2) pixel
+    # coordinates of existing cracks. every branch starts at a random point of a random parent (earlier branches
+    # included), leaves it at 20-60 degrees to either side of the parent's local direction and is 20-50% as long as
+    # the parent. the branch points are ordered from the tip towards the parent, so like every crack its strength
+    # and thickness grow towards the junction.
+    if rng is None:
+        rng = numpy.random
+    num_points = parents.shape[1]
+    # the local direction is taken over a window of points, single segments are too noisy at high depths
+    window = max(1, (num_points - 1) // 16)
+
+    network = list(parents)
+    for points in branch_points:
+        parent = network[rng.randint(len(network))]
+        i = rng.randint(num_points)
+        direction = parent[min(i + window, num_points - 1)] - parent[max(i - window, 0)]
+        angle = math.atan2(direction[1], direction[0]) + rng.choice((-1, 1)) * math.radians(rng.uniform(20, 60))
+        length = rng.uniform(0.2, 0.5) * numpy.hypot(*(parent[-1] - parent[0]))
+
+        # move the branch to the origin, align its chord with angle and scale it to length
+        points = points - points[0]
+        chord = points[-1]
+        scale = length / max(numpy.hypot(*chord), 1e-9)
+        rotation = angle - math.atan2(chord[1], chord[0])
+        cos = scale * math.cos(rotation)
+        sin = scale * math.sin(rotation)
+        branch = numpy.empty_like(points)
+        branch[:, 0] = parent[i, 0] + cos * points[:, 0] - sin * points[:, 1]
+        branch[:, 1] = parent[i, 1] + sin * points[:, 0] + cos * points[:, 1]
+        network.append(branch[::-1])
+
+    return numpy.array(network)
+
+
+def crack_network(TOTALWIDTH, DEPTH, num_cracks=1, num_branches=0, rng=None):
+    # pixel coordinates (num_cracks + num_branches, 4^DEPTH + 1, 2) of num_cracks independently placed cracks and
+    # num_branches branches off them. all polylines have the same number of points, so the whole network is one
+    # batched point set that is rasterized and shaded in one go.
+    points = koch_batch(num_cracks + num_branches, DEPTH, TOTALWIDTH, rng)
+
+    pixels = place_points(TOTALWIDTH, points[:num_cracks])
+    pixels = random_rotate(pixels, TOTALWIDTH, rng)
+    pixels = random_translate(pixels, TOTALWIDTH, rng)
+
+    if num_branches > 0:
+        pixels = branch_off(pixels, points[num_cracks:], rng)
+    return pixels
+
+
+def num_crack_points(DEPTH, num_polylines=1):
+    return num_polylines * (4 ** DEPTH + 1)
+
+
+def segment_depth(TOTALWIDTH, segment_length=1.0):
+    # smallest depth at which the mean segment of a crack spanning the canvas is at most segment_length pixels.
+    # deeper levels only add detail below the pixel grid that the rasterizer cannot show.
+    depth = 0
+    while TOTALWIDTH * (KOCH_LENGTH_GROWTH / 4.0) ** depth > segment_length:
+        depth += 1
+    return depth
+
+
+_seconds_per_point = {}
+
+
+def crack_seconds_per_point(TOTALWIDTH, num_polylines=1):
+    # measured time of point generation and rasterization per crack point, the part of the generation whose cost
+    # grows with the depth (widening and normals only depend on the canvas size). measured once per process with a
+    # stream of its own, so it does not consume random values of the samples.
+    key = (TOTALWIDTH, num_polylines)
+    if key not in _seconds_per_point:
+        rng = numpy.random.RandomState(0)
+        start = time.time()
+        pixels = crack_network(TOTALWIDTH, CALIBRATION_DEPTH, 1, num_polylines - 1, rng)
+        y0, y1, x0, x1 = crack_bounding_box(TOTALWIDTH, pixels.reshape(-1, 2))
+        rasterize_polylines((y1 - y0, x1 - x0), pixels - (x0, y0), images=numpy.zeros(len(pixels), dtype=int))
+        _seconds_per_point[key] = (time.time() - start) / num_crack_points(CALIBRATION_DEPTH, num_polylines)
+    return _seconds_per_point[key]
+
+
+def adaptive_depth(TOTALWIDTH, segment_length=1.0, max_points=None, max_seconds=None, num_polylines=1,
+                   min_depth=1):
+    # fractal depth for a canvas of TOTALWIDTH pixels: deep enough for segments of about segment_length pixels,
+    # capped so a crack map of num_polylines cracks (branches included) has at most max_points points and its
+    # depth dependent generation takes at most about max_seconds. never below min_depth. max_seconds makes the depth
+    # depend on the speed of the machine and its load, see crack_seconds_per_point.
+    depth = max(segment_depth(TOTALWIDTH, segment_length), min_depth)
+    if max_points is not None:
+        while depth > min_depth and num_crack_points(depth, num_polylines) > max_points:
+            depth -= 1
+    if max_seconds is not None:
+        seconds_per_point = crack_seconds_per_point(TOTALWIDTH, num_polylines)
+        while depth > min_depth and num_crack_points(depth, num_polylines) * seconds_per_point > max_seconds:
+            depth -= 1
+    return depth
+
+
+def calculate_normals(img, dtype=numpy.float32, out=None):
+    # the two last axes are the image axes, leading axes (e.g. a batch of cracks) are kept.
+    # gradient, normalization and bias are computed in float32 directly into out, which may also be a preallocated
+    # RGBA buffer (its alpha channel is then set to 1). see normals_from_height in lib/crackmaps.py.
+    return normals_from_height(img, out=out, dtype=dtype)
+
+
+def widen_line(img, dtype=numpy.float32, rng=None):
+    # img is expected as uint8, the widened line is returned in the 0-255 range as dtype
+    if rng is None:
+        rng = numpy.random
+    Blur_scales = numpy.array(BLUR_SCALES)
+    Random_Blur = Blur_scales[rng.randint(0, len(Blur_scales))]
     img = cv2.GaussianBlur(img, (Random_Blur, Random_Blur), 0)
     # re-normalize the image to maximum range
     if img.max() != 0:
-        img = 255 * (img.astype(float) / img.max())
+        img = img.astype(numpy.float32) * numpy.float32(255.0 / img.max())
+        numpy.minimum(img, 255, out=img) # float32 rounding may overshoot the maximum slightly
+        if numpy.issubdtype(dtype, numpy.integer):
+            img = numpy.rint(img)
     else:
         print ( "img.max in widen_line of fractalcracks.py is: " + str(img.max()) )
 
-    return img
+    return img.astype(dtype, copy=False)
+
+
+class WidthProfile:
+    # Variable crack width for widen_line_distance. The width tapers along the crack from min_width at its start to
+    # max_width at its end (taper is the exponent of that interpolation) and depth_exponent shapes the cross-section
+    # of the height map: 1 gives a V-shaped crack, values below 1 a flatter U-shaped bottom, above 1 a sharper tip.
+    def __init__(self, min_width=1.0, max_width=6.0, taper=1.0, depth_exponent=1.0):
+        self.min_width = min_width
+        self.max_width = max_width
+        self.taper = taper
+        self.depth_exponent = depth_exponent
+
+    def __repr__(self):
+        # also used to key cached cracks, see lib/crackcache.py
+        return "WidthProfile(min_width={}, max_width={}, taper={}, depth_exponent={})".format(
+            self.min_width, self.max_width, self.taper, self.depth_exponent)
+
+    @property
+    def max_radius(self):
+        return int(math.ceil(max(self.min_width, self.max_width) / 2.0))
+
+    def half_width(self, position):
+        # position is the relative position along the crack, 0 at its start and 1 at its end
+        return 0.5 * (self.min_width + (self.max_width - self.min_width) * position ** self.taper)
+
+    def depth(self, relative_distance):
+        # relative depth of the crack at distance / half width from its center line
+        return numpy.clip(1 - relative_distance, 0, 1) ** self.depth_exponent
+
+
+def widen_line_distance(img, position, profile, dtype=numpy.float32):
+    # widens the center line img (uint8 strengths) with a distance transform, in time linear in the image size
+    # whatever the width. every pixel takes strength and position along the crack of its nearest center line pixel,
+    # from which the profile gives the local half width and the depth at the pixel's distance.
+    # the widened line is returned in the 0-255 range as dtype, like widen_line.
+    center_line = img > 0
+    if not center_line.any():
+        print ( "img.max in widen_line_distance of fractalcracks.py is: " + str(img.max()) )
+        return img.astype(dtype)
+
+    distance, labels = cv2.distanceTransformWithLabels(numpy.where(center_line, 0, 255).astype(numpy.uint8),
+                                                       cv2.DIST_L2, 5, labelType=cv2.DIST_LABEL_PIXEL)
+
+    # per label (i.e. per center line pixel) strength and half width
+    ys, xs = numpy.nonzero(center_line)
+    center_labels = labels[ys, xs]
+    strength = numpy.zeros(labels.max() + 1, dtype=numpy.float32)
+    strength[center_labels] = img[ys, xs]
+    half_width = numpy.ones(labels.max() + 1, dtype=numpy.float32)
+    half_width[center_labels] = numpy.maximum(profile.half_width(position[ys, xs]), 0.5)
+
+    distance /= half_width[labels]
+    widened = strength[labels]
+    widened *= profile.depth(distance)
+
+    # re-normalize the image to maximum range
+    widened *= numpy.float32(255.0 / widened.max())
+    numpy.minimum(widened, 255, out=widened)
+    if numpy.issubdtype(dtype, numpy.integer):
+        widened = numpy.rint(widened)
+    return widened.astype(dtype, copy=False)
 
 
 # function defining crack falloff
@@ -120,69 +318,306 @@ def get_crack_falloff(num_points, curr_point_index):
 
 
 def get_crack_line_params(num_points, curr_point_index, max_thickness=3):
-    strength = int((255 / num_points) * (curr_point_index + 1))
-    strength = max(50, strength) # do not use values that are too low, 20% at least
-    thickness = int((max_thickness / num_points) * (curr_point_index + 1))
-    thickness = max(1, thickness) # no lines with strength smaller than one
+    # curr_point_index can be a single index or an array of indices
+    curr_point_index = numpy.asarray(curr_point_index)
+    strength = ((255 / num_points) * (curr_point_index + 1)).astype(int)
+    strength = numpy.maximum(50, strength) # do not use values that are too low, 20% at least
+    thickness = ((max_thickness / num_points) * (curr_point_index + 1)).astype(int)
+    thickness = numpy.maximum(1, thickness) # no lines with strength smaller than one
     return strength, thickness
 
 
-def construct_matrix(TOTALWIDTH, points):
-
-    max_y = numpy.max(points[:, 1])
-    min_x = numpy.min(points[:, 0])
-    min_y = numpy.min(points[:, 1])
+def construct_matrix(TOTALWIDTH, points, max_thickness=1):
+    # TODO: thickness is constant (max_thickness=1) by default as parameters need to be selected properly
+    return construct_matrix_batch(TOTALWIDTH, points[numpy.newaxis], max_thickness)[0]
 
-    img = numpy.zeros((TOTALWIDTH, TOTALWIDTH), numpy.uint8)
 
+def place_points(TOTALWIDTH, points):
+    # maps (num_cracks, num_points, 2) koch points to pixel coordinates: x starts at zero, y is centered vertically
+    max_y = numpy.max(points[:, :, 1], axis=1)
+    min_x = numpy.min(points[:, :, 0], axis=1)
+    min_y = numpy.min(points[:, :, 1], axis=1)
     pad = (TOTALWIDTH - (max_y - min_y)) / 2
+
+    pixels = numpy.empty(points.shape, dtype=float)
+    pixels[:, :, 0] = points[:, :, 0] - min_x[:, numpy.newaxis]
+    pixels[:, :, 1] = pad[:, numpy.newaxis] + points[:, :, 1] - min_y[:, numpy.newaxis]
+    return pixels
+
+
+def construct_matrix_batch(TOTALWIDTH, points, max_thickness=1):
+    # integer line end points, like the int() casts of the original per line drawing
+    pixels = numpy.trunc(place_points(TOTALWIDTH, points))
+    return rasterize_polylines(TOTALWIDTH, pixels, max_thickness)
+
+
+def crack_bounding_box(TOTALWIDTH, pixels, max_thickness=1, width_profile=None):
+    # (y0, y1, x0, x1) of the region of the canvas a crack with the given pixel coordinates can touch after
+    # rasterization, widening and normal calculation, i.e. the crack's extent padded by line thickness, blur radius
+    # (or width profile) and two zero pixels, so the one-sided gradient at the tile border equals the central one of
+    # the full map. outside of it the crack maps are guaranteed to be background.
+    if width_profile is None:
+        widening = max(BLUR_SCALES) // 2
+    else:
+        widening = width_profile.max_radius
+    margin = max_thickness // 2 + widening + 2
+    low = round_pixels(pixels.min(axis=0)) - margin
+    high = round_pixels(pixels.max(axis=0)) + margin + 1
+
+    # clip to the canvas but always keep at least one pixel
+    x0, y0 = numpy.clip(low, 0, TOTALWIDTH - 1)
+    x1 = int(numpy.clip(high[0], x0 + 1, TOTALWIDTH))
+    y1 = int(numpy.clip(high[1], y0 + 1, TOTALWIDTH))
+    return int(y0), y1, int(x0), x1
+
+
+def round_pixels(pixels):
+    # nearest integer pixel coordinates with halves rounded up. unlike numpy.rint (halves to even) this commutes with
+    # integer shifts, so a crack rasterized into a tile hits the same pixels as in the full map.
+    return numpy.floor(numpy.asarray(pixels) + 0.5).astype(int)
+
+
+def bresenham_offsets(delta, step):
+    # pixel offsets from the start point of step along segments with integer extent delta (..., 2), like
+    # cv2.line (8-connected LineIterator): the minor axis advances once the accumulated error exceeds half a pixel,
+    # i.e. step * minor / major rounded half down. segments must run left to right (delta x >= 0).
+    extent = numpy.abs(delta)
+    x_major = extent[:, 0] >= extent[:, 1]
+    major = numpy.maximum(extent.max(axis=1), 1)
+    minor = extent.min(axis=1)
+    minor_offset = (2 * minor * step + major - 1) // (2 * major)
+    sign = numpy.sign(delta)
+    offsets = numpy.empty(delta.shape, dtype=int)
+    offsets[:, 0] = numpy.where(x_major, step, minor_offset) * sign[:, 0]
+    offsets[:, 1] = numpy.where(x_major, minor_offset, step) * sign[:, 1]
+    return offsets
+
+
+def _outcodes(x, y, right, bottom, vertical=True):
+    codes = (x < 0) + (x > right) * 2
+    if vertical:
+        codes = codes + (y < 0) * 4 + (y > bottom) * 8
+    return codes
+
+
+def clip_segments(start, end, width, height):
+    # clips integer segments (n, 2) to the canvas like cv2.line does before walking them (cv::clipLine, including
+    # its truncating integer arithmetic), so segments leaving the canvas keep the pixels cv2 draws.
+    # returns the clipped start and end points and whether anything of a segment is left.
+    start = start.astype(numpy.int64)
+    end = end.astype(numpy.int64)
+    x1, y1 = start[:, 0], start[:, 1]
+    x2, y2 = end[:, 0], end[:, 1]
+    right, bottom = width - 1, height - 1
+    c1 = _outcodes(x1, y1, right, bottom)
+    c2 = _outcodes(x2, y2, right, bottom)
+
+    def moved(position, numerator, length, denominator):
+        # position + trunc(numerator * length / denominator), computed only where it is used
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            shift = numerator.astype(float) * length / numpy.where(denominator == 0, 1, denominator)
+        return position + shift.astype(numpy.int64)
+
+    clip = ((c1 & c2) == 0) & ((c1 | c2) != 0)
+    # first to the top and bottom border
+    vertical = clip & ((c1 & 12) != 0)
+    a = numpy.where(c1 < 8, 0, bottom)
+    x1 = numpy.where(vertical, moved(x1, a - y1, x2 - x1, y2 - y1), x1)
+    y1 = numpy.where(vertical, a, y1)
+    c1 = numpy.where(vertical, _outcodes(x1, y1, right, bottom, False), c1)
+    vertical = clip & ((c2 & 12) != 0)
+    a = numpy.where(c2 < 8, 0, bottom)
+    x2 = numpy.where(vertical, moved(x2, a - y2, x2 - x1, y2 - y1), x2)
+    y2 = numpy.where(vertical, a, y2)
+    c2 = numpy.where(vertical, _outcodes(x2, y2, right, bottom, False), c2)
+    # then to the left and right border
+    clip &= ((c1 & c2) == 0) & ((c1 | c2) != 0)
+    horizontal = clip & (c1 != 0)
+    a = numpy.where(c1 == 1, 0, right)
+    y1 = numpy.where(horizontal, moved(y1, a - x1, y2 - y1, x2 - x1), y1)
+    x1 = numpy.where(horizontal, a, x1)
+    c1 = numpy.where(horizontal, 0, c1)
+    horizontal = clip & (c2 != 0)
+    a = numpy.where(c2 == 1, 0, right)
+    y2 = numpy.where(horizontal, moved(y2, a - x2, y2 - y1, x2 - x1), y2)
+    x2 = numpy.where(horizontal, a, x2)
+    c2 = numpy.where(horizontal, 0, c2)
+
+    return numpy.stack((x1, y1), axis=1), numpy.stack((x2, y2), axis=1), (c1 | c2) == 0
+
+
+def rasterize_polylines(shape, pixels, max_thickness=1, positions=False, images=None):
+    # rasterizes (num_cracks, num_points, 2) pixel coordinates into a (num_images, height, width) stack, shape is
+    # either the width of a square canvas or a (height, width) tuple. images is the index of the output image of
+    # every crack, by default every crack gets an image of its own. cracks sharing an image are max-combined.
+    # all segments of all cracks are drawn in one go, with per segment strength and thickness falloff.
+    # with positions=True a second float32 stack holding the relative position along the crack (0-1) of every
+    # drawn pixel is returned as well.
+    num_cracks, num_points = pixels.shape[0:2]
+    if images is None:
+        images = numpy.arange(num_cracks)
+    num_images = int(numpy.max(images)) + 1
+    if numpy.ndim(shape) == 0:
+        shape = (shape, shape)
+    height, width = shape
+
+    pixels = round_pixels(pixels)
+    # copies, clipping moves the end points of single segments
+    start = pixels[:, :-1].reshape(-1, 2).copy()
+    end = pixels[:, 1:].reshape(-1, 2).copy()
+
     # TODO: think of function that varies 255 in height map across the length of the crack. Point set should be ordered.
-    for pidx, p in enumerate(points[:-1]):
-        strength, thickness = get_crack_line_params(len(points), pidx, max_thickness=5)
-        cv2.line(img,
-                 (int(p[0] - min_x), int(pad + p[1] - min_y)),
-                 (int((points[pidx + 1, 0] - min_x)), int(pad + points[pidx + 1, 1] - min_y)),
-                 strength, # at least 20% visibility
-                 1) # # TODO: currently thickness is constant as parameters need to be selected properly
+    strength, thickness = get_crack_line_params(num_points, numpy.arange(num_points - 1), max_thickness)
+    strength = numpy.tile(strength, num_cracks).astype(numpy.uint8)
+    thickness = numpy.tile(thickness, num_cracks)
+    crack = numpy.repeat(images, num_points - 1)
+
+    # one pixel wide segments are clipped to the canvas like cv2.line clips them, wider ones are stamped unclipped
+    thin = thickness == 1
+    clipped_start, clipped_end, visible = clip_segments(start[thin], end[thin], width, height)
+    start[thin] = clipped_start
+    end[thin] = clipped_end
+    keep = numpy.ones(len(start), dtype=bool)
+    keep[thin] = visible
+    start, end = start[keep], end[keep]
+    strength, thickness, crack = strength[keep], thickness[keep], crack[keep]
+    # cv2.line walks every segment from its left end point, which decides the pixels of ties
+    backwards = (end[:, 0] < start[:, 0])[:, numpy.newaxis]
+    start, end = numpy.where(backwards, end, start), numpy.where(backwards, start, end)
+
+    # walk every segment in unit steps along its major axis (Bresenham), all segments in one go
+    steps = numpy.abs(end - start).max(axis=1)
+    counts = steps + 1
+    segment = numpy.repeat(numpy.arange(len(steps)), counts)
+    step = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    xy = start[segment] + bresenham_offsets((end - start)[segment], step)
+
+    img = numpy.zeros((num_images, height, width), numpy.uint8)
+    if positions:
+        position = numpy.tile(numpy.arange(1, num_points, dtype=numpy.float32) / (num_points - 1), num_cracks)[keep]
+        position_img = numpy.zeros((num_images, height, width), numpy.float32)
+    # one stamp per distinct thickness: all line pixels of that thickness are offset by a disk of that diameter
+    for line_thickness in numpy.unique(thickness[segment]):
+        selected = thickness[segment] == line_thickness
+        radius = line_thickness // 2
+        dy, dx = numpy.mgrid[-radius:radius + 1, -radius:radius + 1]
+        disk = (dx ** 2 + dy ** 2) <= (line_thickness / 2.0) ** 2
+        stamp_x = (xy[selected, 0][:, numpy.newaxis] + dx[disk]).ravel()
+        stamp_y = (xy[selected, 1][:, numpy.newaxis] + dy[disk]).ravel()
+        stamp_segment = numpy.repeat(segment[selected], numpy.count_nonzero(disk))
+
+        inside = (stamp_x >= 0) & (stamp_x < width) & (stamp_y >= 0) & (stamp_y < height)
+        stamp_segment = stamp_segment[inside]
+        # strength grows along the crack, so keeping the maximum matches later lines being drawn over earlier ones
+        stamp = (crack[stamp_segment], stamp_y[inside], stamp_x[inside])
+        numpy.maximum.at(img, stamp, strength[stamp_segment])
+        if positions:
+            numpy.maximum.at(position_img, stamp, position[stamp_segment])
+
+    if positions:
+        return img, position_img
     return img
 
 
 def invert_matrix(img):
-    img[:, :, 0:3] = 1 - img[:, :, 0:3]
+    img[..., 0:3] = intensity_max(img.dtype) - img[..., 0:3]
     return img
 
 
 def add_alpha_channel(img):
     # convert grayscale to BGRA
-    img = numpy.repeat(img[:, :, numpy.newaxis], 4, axis=2)
+    img = numpy.repeat(img[..., numpy.newaxis], 4, axis=-1)
     return img
 
 
-def generate_fractal_cracks(TOTALWIDTH, DEPTH):
-    points = koch(DEPTH, TOTALWIDTH)
+def generate_crack_maps(TOTALWIDTH, DEPTH, max_thickness=1, dtype=numpy.float32, normal_dtype=numpy.float32,
+                        sparse=True, normals=True, width_profile=None, num_cracks=1, num_branches=0, rng=None):
+    # returns the CrackMaps of a crack network of num_cracks cracks and num_branches branches off them (a single
+    # crack by default), see crack_network. all cracks are rasterized into one canvas, widened and shaded together.
+    # with sparse=True the network is rasterized, widened and shaded only inside its padded bounding box and stored
+    # as that tile plus its offset, which keeps large resolutions cheap.
+    # with normals=False no normals are stored, CrackMaps computes them when they are expanded for blender.
+    # width_profile selects the distance transform width model (see WidthProfile), None the random gaussian blur.
+    pixels = crack_network(TOTALWIDTH, DEPTH, num_cracks, num_branches, rng)
 
-    # construct a square matrix and fill it with lines between points
-    img = construct_matrix(TOTALWIDTH, points)
+    if sparse:
+        # draw the network into its tile only
+        y0, y1, x0, x1 = crack_bounding_box(TOTALWIDTH, pixels.reshape(-1, 2), max_thickness, width_profile)
+    else:
+        y0, y1, x0, x1 = 0, TOTALWIDTH, 0, TOTALWIDTH
+    imgs = rasterize_polylines((y1 - y0, x1 - x0), pixels - (x0, y0), max_thickness, width_profile is not None,
+                               images=numpy.zeros(len(pixels), dtype=int))
 
-    # random rotation and translation
-    img = random_rotate(img)
-    img = random_translate(img, TOTALWIDTH)
+    cracks, normal_maps = shade_cracks(imgs, dtype, normal_dtype, rng, normals, width_profile)
+    return CrackMaps(cracks[0], normal_maps[0] if normals else None, depth=DEPTH, max_thickness=max_thickness,
+                     offset=(y0, x0), resolution=TOTALWIDTH)
 
-    # widen the line with a random gaussian blur
-    img = widen_line(img)
 
-    # normal calculation
-    normals = calculate_normals(img)
+def generate_fractal_cracks(TOTALWIDTH, DEPTH, max_thickness=1, dtype=numpy.float32, normal_dtype=numpy.float32,
+                            width_profile=None, rng=None):
+    # This returns ground truth, roughness, normal and height maps.
+    return generate_crack_maps(TOTALWIDTH, DEPTH, max_thickness, dtype, normal_dtype, width_profile=width_profile,
+                               rng=rng).as_tuple()
 
-    # normalize to 0-1 range as blender expects this range for RGBA
-    img = img.astype(dtype=float) / 255.0
+
+def generate_fractal_cracks_batch(N, TOTALWIDTH, DEPTH, max_thickness=1, dtype=numpy.float32,
+                                  normal_dtype=numpy.float32, width_profile=None, rng=None):
+    cracks, normals = generate_crack_batch(N, TOTALWIDTH, DEPTH, max_thickness, dtype, normal_dtype, rng,
+                                           width_profile=width_profile)
 
     # alpha channel addition
-    img = add_alpha_channel(img)
+    imgs = add_alpha_channel(cracks)
 
-    height_img = numpy.copy(img) # copy so it will not be inverted
-    # invert the matrix so the crack is black and the background is white
-    img = invert_matrix(img)
+    height_imgs = numpy.copy(imgs) # copy so it will not be inverted
+    # invert the matrices so the cracks are black and the background is white
+    imgs = invert_matrix(imgs)
 
-    # This returns ground truth, roughness, normal and height maps.
-    return img, img, normals, height_img
+    # This returns ground truth, roughness, normal and height maps, each of shape (N, W, W, C).
+    return imgs, imgs, normals, height_imgs
+
+
+def generate_crack_batch(N, TOTALWIDTH, DEPTH, max_thickness=1, dtype=numpy.float32, normal_dtype=numpy.float32,
+                         rng=None, normals=True, width_profile=None):
+    # generates N cracks and returns their single channel intensities (N, W, W) and normals (N, W, W, 3).
+    # dtype is used for the crack intensities, from which ground truth, roughness and height maps are derived:
+    # numpy.uint8 gives 0-255 masks, float types the 0-1 range. normal_dtype should be numpy.float32 or numpy.float16.
+    points = koch_batch(N, DEPTH, TOTALWIDTH, rng)
+
+    # random rotation and translation are applied to the points, so the cracks are drawn straight into their
+    # final place without resampling the whole image
+    pixels = place_points(TOTALWIDTH, points)
+    pixels = random_rotate(pixels, TOTALWIDTH, rng)
+    pixels = random_translate(pixels, TOTALWIDTH, rng)
+
+    # construct N square matrices and fill them with lines between points
+    imgs = rasterize_polylines(TOTALWIDTH, pixels, max_thickness, width_profile is not None)
+
+    return shade_cracks(imgs, dtype, normal_dtype, rng, normals, width_profile)
+
+
+def shade_cracks(imgs, dtype=numpy.float32, normal_dtype=numpy.float32, rng=None, normals=True, width_profile=None):
+    # turns a stack of rasterized uint8 cracks into crack intensities of the given dtype and their normals.
+    # with normals=False None is returned instead of the normals.
+    # with a width_profile, imgs is the (cracks, positions) pair returned by rasterize_polylines(..., positions=True)
+    if width_profile is not None:
+        imgs, positions = imgs
+
+    cracks = numpy.empty(imgs.shape, dtype=dtype)
+    for i in range(len(imgs)):
+        if width_profile is not None:
+            # widen the line along the crack according to the width profile
+            cracks[i] = widen_line_distance(imgs[i], positions[i], width_profile, dtype)
+        else:
+            # widen the line with a random gaussian blur, drawn per crack
+            cracks[i] = widen_line(imgs[i], dtype, rng)
+
+    # normal calculation for the whole batch
+    normal_maps = None
+    if normals:
+        normal_maps = calculate_normals(cracks, normal_dtype)
+
+    # normalize to 0-1 range as blender expects this range for RGBA
+    if not numpy.issubdtype(dtype, numpy.integer):
+        cracks /= 255.0
+
+    return cracks, normal_maps
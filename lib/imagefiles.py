@@ -0,0 +1,80 @@
+import json
+import os
+
+import numpy
+# cv2 reads OpenEXR files only if enabled (opencv 4.2 and newer)
+os.environ.setdefault('OPENCV_IO_ENABLE_OPENEXR', '1')
+import cv2
+
+# Formats depth maps are written in:
+#   exr  32 bit float OpenEXR as rendered by blender
+#   npy  float16 array, about 1 mm resolution at 2 m
+#   npz  float16 array, zip compressed
+#   png  16 bit grayscale PNG of depth / scale. the scale is written next to it, as <name>.json
+# pixels without a surface are inf in the float16 formats and BACKGROUND_PNG in PNGs
+DEPTH_FORMATS = ('exr', 'npy', 'npz', 'png')
+# depth blender writes where no surface is hit
+BACKGROUND_DEPTH = 1e10
+BACKGROUND_PNG = 65535
+
+
+def read_exr(path):
+    # float32 array of an OpenEXR file, rows top to bottom and channels BGR like cv2.imread
+    image = cv2.imread(path, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
+    if image is None:
+        raise IOError("could not read " + path)
+    return image
+
+
+def _scale_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def write_depth(path, depth, depth_format):
+    # writes the float depth map depth to path in one of DEPTH_FORMATS except exr
+    background = ~(depth < BACKGROUND_DEPTH)
+    if depth_format in ('npy', 'npz'):
+        with numpy.errstate(over='ignore'):
+            half = depth.astype(numpy.float16)
+        half[background] = numpy.inf
+        if depth_format == 'npy':
+            numpy.save(path, half)
+        else:
+            numpy.savez_compressed(path, depth=half)
+    elif depth_format == 'png':
+        # the farthest surface gets the largest value below the background
+        far = depth[~background].max() if not background.all() else 0
+        scale = float(far) / (BACKGROUND_PNG - 1) if far > 0 else 1.0
+        values = numpy.rint(numpy.where(background, 0, depth) / scale).astype(numpy.uint16)
+        values[background] = BACKGROUND_PNG
+        if not cv2.imwrite(path, values):
+            raise IOError("could not write " + path)
+        with open(_scale_path(path), 'w') as f:
+            json.dump({'scale': scale, 'background': BACKGROUND_PNG}, f)
+    else:
+        raise ValueError("unknown depth format: " + str(depth_format))
+
+
+def read_depth(path):
+    # float32 depth map of a file written by blender or write_depth, pixels without a surface are inf except in
+    # blender's OpenEXR files
+    extension = os.path.splitext(path)[1]
+    if extension == '.exr':
+        depth = read_exr(path)
+        # all color channels hold the depth
+        return depth if depth.ndim == 2 else depth[..., 2]
+    if extension == '.npy':
+        return numpy.load(path).astype(numpy.float32)
+    if extension == '.npz':
+        with numpy.load(path) as npz:
+            return npz['depth'].astype(numpy.float32)
+    if extension == '.png':
+        values = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if values is None:
+            raise IOError("could not read " + path)
+        with open(_scale_path(path)) as f:
+            meta = json.load(f)
+        depth = values.astype(numpy.float32) * meta['scale']
+        depth[values == meta['background']] = numpy.inf
+        return depth
+    raise ValueError("unknown depth file: " + path)
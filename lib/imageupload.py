@@ -0,0 +1,65 @@
+import os
+
+import cv2
+import numpy
+
+# Methods of moving an RGBA float array into the pixels of a blender image, fastest first:
+#   foreach_set  write through the buffer protocol, no python objects are created (bpy_prop_array.foreach_set,
+#                newer blender versions only)
+#   file         write an 8 bit RGBA PNG and let blender load it. lossless for byte images, which is what
+#                bpy.data.images.new creates by default: blender rounds assigned floats to bytes the same way.
+#                the alpha channel is written for images created without alpha too, their byte buffer keeps the
+#                assigned alpha as well.
+#   list         assignment of a python list of floats, slow and memory hungry but always available
+UPLOAD_METHODS = ('foreach_set', 'file', 'list')
+# directory of the intermediate files of the file method, one file per image
+UPLOAD_DIRECTORY = os.path.join('tmp', 'textures')
+
+
+def upload_method(image):
+    # fastest method available for image in the running blender
+    if hasattr(image.pixels, 'foreach_set'):
+        return 'foreach_set'
+    if not image.is_float:
+        return 'file'
+    return 'list'
+
+
+def float_to_bytes(rgba):
+    # blender's float to byte conversion of pixel assignments: clamped, rounded half up
+    return numpy.floor(numpy.clip(rgba, 0, 1) * 255 + 0.5).astype(numpy.uint8)
+
+
+def write_pixels_png(path, rgba, alpha=True):
+    # writes pixels in blender's layout (rows bottom to top, RGBA) as PNG (rows top to bottom, BGR(A))
+    if alpha:
+        pixels = cv2.cvtColor(float_to_bytes(rgba[::-1]), cv2.COLOR_RGBA2BGRA)
+    else:
+        pixels = cv2.cvtColor(float_to_bytes(rgba[::-1, :, 0:3]), cv2.COLOR_RGB2BGR)
+    # the file is read once right away, compression would only cost time
+    if not cv2.imwrite(path, pixels, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+        raise IOError("could not write " + path)
+
+
+def upload_pixels(image, rgba, method=None):
+    # sets the pixels of image to the (height, width, 4) array rgba, by default with the fastest available method
+    if method is None:
+        method = upload_method(image)
+    rgba = numpy.ascontiguousarray(rgba, dtype=numpy.float32)
+
+    if method == 'foreach_set':
+        image.pixels.foreach_set(rgba.ravel())
+    elif method == 'file':
+        if not os.path.isdir(UPLOAD_DIRECTORY):
+            os.makedirs(UPLOAD_DIRECTORY)
+        # the file stays in place, blender may free the image buffer and read it again later
+        path = os.path.abspath(os.path.join(UPLOAD_DIRECTORY, image.name + '.png'))
+        write_pixels_png(path, rgba)
+        image.filepath_raw = path
+        image.source = 'FILE'
+        image.reload()
+    elif method == 'list':
+        image.pixels = rgba.ravel().tolist()
+    else:
+        raise ValueError("unknown upload method: " + str(method))
+    return method
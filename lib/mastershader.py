@@ -1,10 +1,14 @@
 import bpy
 
+from lib.texturecache import TextureCache
+
 class MasterShader:
 
     def __init__(self, material_name, albedo_texture_path, roughness_texture_path,
-                 normal_texture_path, height_texture_path):
+                 normal_texture_path, height_texture_path, texture_cache=None):
         self.name = material_name
+        # concrete texture images, loaded once per path while they fit into the cache's memory budget
+        self.texture_cache = TextureCache() if texture_cache is None else texture_cache
         self.albedoTexPath = albedo_texture_path
         self.roughnessTexPath = roughness_texture_path
         self.normalTexPath = normal_texture_path
@@ -84,26 +88,56 @@ class MasterShader:
                                  self._nodes['normalmapconcrete'].inputs[1])
         self._nodetree.links.new(self._nodes['normalmapconcrete'].outputs[0], self._nodes['pbr'].inputs['Normal'])
 
+    def _normal_map_color(self):
+        # output of the normal map shown in normal mode
+        return self._nodes['normalconcrete'].outputs['Color']
+
+    def set_shader_mode_color_and_normal(self):
+        # color mode plus the normal map as emission that only camera rays see: one render then holds the normal
+        # map in its emission pass and the color image in its combined pass minus the emission pass. the emission
+        # is not sampled as light either, so it lights nothing.
+        self.set_shader_mode_color()
+        if 'normalemit' not in self._nodes:
+            self._nodes.new('ShaderNodeLightPath')
+            self._nodes['Light Path'].name = 'camerapath'
+            self._nodes['camerapath'].location = [250, -400]
+            self._nodes.new('ShaderNodeEmission')
+            self._nodes['Emission'].name = 'normalemit'
+            self._nodes['normalemit'].location = [450, -300]
+            self._nodes.new('ShaderNodeAddShader')
+            self._nodes['Add Shader'].name = 'colorandnormal'
+            self._nodes['colorandnormal'].location = [650, 100]
+            self._nodetree.links.new(self._nodes['camerapath'].outputs['Is Camera Ray'],
+                                     self._nodes['normalemit'].inputs['Strength'])
+            bpy.data.materials[self.name].cycles.sample_as_light = False
+
+        self._nodetree.links.new(self._normal_map_color(), self._nodes['normalemit'].inputs['Color'])
+        self._nodetree.links.new(self._nodes['pbr'].outputs[0], self._nodes['colorandnormal'].inputs[0])
+        self._nodetree.links.new(self._nodes['normalemit'].outputs['Emission'],
+                                 self._nodes['colorandnormal'].inputs[1])
+        self._nodetree.links.new(self._nodes['colorandnormal'].outputs['Shader'],
+                                 self._nodes['Material Output'].inputs['Surface'])
+
     def _load_images_to_textures_nodes(self):
         # albedo map
-        bpy.data.images.load(filepath=self.albedoTexPath)
-        self._nodes['albedoconcrete'].image = bpy.data.images[self.albedoTexPath.split("/")[-1]]
+        self._nodes['albedoconcrete'].image = self.texture_cache.load(self.albedoTexPath)
 
         # roughness map
-        bpy.data.images.load(filepath=self.roughnessTexPath)
-        self._nodes['roughnessconcrete'].image = bpy.data.images[self.roughnessTexPath.split("/")[-1]]
+        self._nodes['roughnessconcrete'].image = self.texture_cache.load(self.roughnessTexPath)
 
         # normal map
-        bpy.data.images.load(filepath=self.normalTexPath)
-        self._nodes['normalconcrete'].image = bpy.data.images[self.normalTexPath.split("/")[-1]]
+        self._nodes['normalconcrete'].image = self.texture_cache.load(self.normalTexPath)
 
         # height map
         # TODO: This needs to go into the displacement modifier of the mesh!!!
-        bpy.data.images.load(filepath=self.heightTexPath)
-        # TODO: Height tex path being assigned to an image in a improper way. Needs to be fixed.
-        self._nodes['heightconcrete'].image = bpy.data.images[self.heightTexPath.split("/")[-1]]
-        # TODO: returning height texture path so that it can be used for displacement of mesh. This is an improper fix.
-        return self.heightTexPath.split("/")[-1]
+        height_image = self.texture_cache.load(self.heightTexPath)
+        self._nodes['heightconcrete'].image = height_image
+
+        # make room for the next texture sets, the current one stays loaded
+        self.texture_cache.evict(keep=(self.albedoTexPath, self.roughnessTexPath, self.normalTexPath,
+                                       self.heightTexPath))
+        # TODO: returning height texture name so that it can be used for displacement of mesh. This is an improper fix.
+        return height_image.name
 
     def apply_to_blender_object(self, blender_obj):
         blender_obj.select = True
@@ -133,7 +167,8 @@ class MasterShader:
         self.normalTexPath = normal_path
         self.heightTexPath = height_path
 
-    def sample_texture(self):
+    def sample_texture(self, rng=None):
+        # rng is the random stream of the current sample, concrete textures are not randomized here
         # TODO: returning height texture path so that it can be used for displacement of mesh. This is an imroper fix.
         heightTexturePath = self._load_images_to_textures_nodes()
         return heightTexturePath
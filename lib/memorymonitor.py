@@ -0,0 +1,88 @@
+import json
+import os
+import resource
+import time
+import tracemalloc
+
+import bpy
+
+from lib.texturecache import image_nbytes
+
+# datablock collections of bpy.data whose counts are recorded
+DATABLOCKS = ('images', 'meshes', 'materials', 'textures')
+
+
+def current_rss():
+    # resident set size of the process in bytes. /proc on linux, elsewhere the peak RSS is the best available
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if os.uname()[0] == 'Darwin' else maxrss * 1024
+
+
+def datablock_stats():
+    # counts of the datablocks in bpy.data and the bytes of all loaded image buffers
+    stats = dict((name, len(getattr(bpy.data, name))) for name in DATABLOCKS)
+    stats['image_pixel_bytes'] = sum(image_nbytes(image) for image in bpy.data.images if image.has_data)
+    return stats
+
+
+def is_monotonic_growth(values, window):
+    # True if the last window values never decrease and the last is larger than the first of them
+    if len(values) < window:
+        return False
+    values = values[-window:]
+    return all(b >= a for a, b in zip(values, values[1:])) and values[-1] > values[0]
+
+
+class MemoryMonitor:
+    # Records memory use of the render loop after every image as one JSON line in path: process RSS, datablock
+    # counts and image buffer bytes of bpy.data and the top growth sites of python allocations (tracemalloc, which
+    # sees numpy buffers but not blender's own allocations) since the previous record. A quantity is flagged as
+    # growing when it has not decreased over the last window records.
+    def __init__(self, path, window=5, top=10):
+        self.path = path
+        self.window = window
+        self.top = top
+        self.history = []
+
+        tracemalloc.start()
+        self._snapshot = tracemalloc.take_snapshot()
+        self._file = open(path, 'w')
+
+    def record(self, iteration, **info):
+        snapshot = tracemalloc.take_snapshot()
+        top_growth = [{'site': str(stat.traceback), 'size_diff': stat.size_diff, 'count_diff': stat.count_diff}
+                      for stat in snapshot.compare_to(self._snapshot, 'lineno')[:self.top] if stat.size_diff > 0]
+        self._snapshot = snapshot
+
+        stats = datablock_stats()
+        stats['rss'] = current_rss()
+        stats['python_bytes'] = tracemalloc.get_traced_memory()[0]
+        self.history.append(stats)
+
+        growing = sorted(name for name in stats
+                         if is_monotonic_growth([h[name] for h in self.history], self.window))
+        line = dict(info, iteration=iteration, time=time.time(), growing=growing, top_growth=top_growth, **stats)
+        self._file.write(json.dumps(line) + '\n')
+        self._file.flush()
+        if growing:
+            print("memory monitor: steady growth of " + ", ".join(growing))
+        return line
+
+    def rss_growth(self, warmup=1):
+        # RSS growth in bytes since the record after warmup iterations, which excludes one-off allocations of the
+        # first images (texture loads, kernel compilation)
+        if len(self.history) <= warmup:
+            return 0
+        return self.history[-1]['rss'] - self.history[warmup]['rss']
+
+    def close(self):
+        self._file.close()
+        tracemalloc.stop()
@@ -0,0 +1,36 @@
+import numpy
+
+# Independent random number streams per rendered sample.
+# Every sample draws all of its random values (concrete texture, sun rotation, crack, displacement strength) from
+# its own numpy.random.RandomState, seeded from the run seed and the sample index. A sample therefore does not
+# depend on how many or which samples were rendered before it: parallel workers rendering disjoint index ranges
+# produce exactly the images of a serial run, and a single sample can be regenerated from its index alone.
+
+# upper bound (exclusive) of seeds drawn from a stream, e.g. for crack maps
+MAX_SEED = 2**31 - 1
+# sub-stream of a sample the seed of its crack is drawn from
+CRACK_STREAM = 1
+
+
+def new_run_seed():
+    # fresh run seed from os entropy, print it to be able to reproduce the run
+    return int(numpy.random.RandomState().randint(MAX_SEED))
+
+
+def sample_rng(run_seed, sample_index):
+    # RandomState seeded with the key (run_seed, sample_index), different keys give independent streams
+    return numpy.random.RandomState([run_seed, sample_index])
+
+
+def crack_seed(run_seed, sample_index):
+    # seed of the crack of a sample. it has a stream of its own, so the cracks of upcoming samples are known before
+    # they are rendered and can be generated ahead of time, see lib/crackprefetcher.py
+    return draw_seed(numpy.random.RandomState([run_seed, sample_index, CRACK_STREAM]))
+
+
+def draw_seed(rng=None):
+    # seed for a nested stream, e.g. the crack of a sample, so the nested generation always consumes exactly one
+    # value of the sample's stream no matter whether the crack is generated, cached or taken from a bank
+    if rng is None:
+        rng = numpy.random
+    return int(rng.randint(MAX_SEED))
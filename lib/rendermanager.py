@@ -1,17 +1,61 @@
 import bpy
 import numpy as np
 import os
+import time
 import cv2
-#import OpenEXR
-#import Imath
+
+from lib.imagefiles import read_exr, read_depth, write_depth
+from lib.renderprofiles import RenderProfile, DEFAULT_PROFILES
+
+# name of the compositor node writing all outputs of a single pass render
+SINGLE_PASS_OUTPUT = 'SinglePassOutput'
+# name of the compositor node writing the texture coordinates of a color render, see setup_uv_output
+UV_OUTPUT = 'UVOutput'
+# image color modes the passes are written with to their final destination
+OUTPUT_COLOR_MODES = {'color': 'BW', 'normal': 'RGB', 'gt': 'RGB'}
+
+
+def binarize_gt(gt):
+    # every pixel of the ground-truth render that is not black is crack
+    gt = (gt > 0).astype(np.uint8)
+    gt *= 255
+    return gt
+
+
+def uv_ground_truth(uv, crack_maps):
+    # ground truth of crack_maps seen through the camera, a mask like a binarized ground-truth render: 255 where the
+    # crack intensity at the texture coordinates uv (see CrackMaps.lookup) is above 0, 0 elsewhere
+    return binarize_gt(crack_maps.lookup(uv))
+
+
 class RenderManager():
-    def __init__(self, path, frames, samples, resolution, tilesize, cracked):
+    def __init__(self, path, frames, samples, resolution, tilesize, cracked, single_pass=False, profiles=None,
+                 measure_savings=False, uv_lookup=False, depth_format='exr'):
         self.path = path
         self.frames = frames
         self.samples = samples
         self.resolution = resolution
         self.tilesize = tilesize
         self.cracked = cracked
+        # render color, normals, ground truth and depth of a camera in one render job, see setup_single_pass
+        self.single_pass = single_pass
+        self._single_pass_ready = False
+        # look the ground truth up at the texture coordinates of the color render instead of rendering it, see
+        # setup_uv_output. the texture coordinates of the last color render per camera name are kept in uv.
+        self.uv_lookup = uv_lookup
+        self._uv_output_ready = False
+        self.uv = {}
+        # format of the depth files, see lib/imagefiles.py. depth written in a compact format is decoded and added
+        # to the result lists, OpenEXR files are written by blender as they are.
+        self.depth_format = depth_format
+
+        # RenderProfile per pass ('color', 'normal', 'gt', 'depth'), see profile()
+        self.profiles = {} if profiles is None else profiles
+        # render times per pass. with measure_savings every auxiliary pass is rendered once more with the color
+        # profile, to report the time its own profile saves
+        self.pass_times = {}
+        self.measure_savings = measure_savings
+        self.baseline_times = {}
         
         # Place-holder lists for rendered image, normal map and ground-truth
         self.result_imgs = []
@@ -30,7 +74,11 @@ class RenderManager():
     def setScene(self, scene):
         self.scene = scene
 
-    def render(self, camera):
+    def render(self, camera, outputs=None):
+        # outputs maps passes ('color', 'normal', 'gt', 'depth') to the files they are written to. blender writes
+        # these passes directly to their destination and they are not added to the result lists. depth is always
+        # written to a file.
+        outputs = {} if outputs is None else outputs
         bpy.data.scenes['Scene'].frame_end = self.frames
         bpy.data.scenes['Scene'].render.filepath = self.path
         bpy.data.scenes['Scene'].cycles.samples = self.samples
@@ -45,24 +93,40 @@ class RenderManager():
         bpy.data.scenes['Scene'].render.tile_x = self.tilesize
         bpy.data.scenes['Scene'].render.tile_y = self.tilesize
 
+        # TODO: NASTY HARDCODING HERE
+        depth_path = outputs.get(
+            'depth', os.path.join('res/depth' + str(self.result_depth_counter) + '.' + self.depth_format))
+
+        if self.single_pass:
+            self.render_all(camera, self.result_imgs, self.result_normals, self.result_gt, depth_path,
+                            self.result_depth, outputs=outputs)
+            self.result_depth_counter += 1
+            return
+
         # render color image left
-        self.render_img(filepath=self.path, camera=camera, save_list=self.result_imgs)
+        self.render_img(filepath=self.path, camera=camera, save_list=self.result_imgs, output=outputs.get('color'))
         
         # render normalmap
-        self.render_np(filepath=self.path, camera=camera, save_list=self.result_normals)
+        self.render_np(filepath=self.path, camera=camera, save_list=self.result_normals,
+                       output=outputs.get('normal'))
 
         # render groundtruth
-        self.render_gt(filepath=self.path, camera=camera, crackflag=self.cracked, save_list=self.result_gt)
+        if self.uv_lookup:
+            self.lookup_gt(camera=camera, crackflag=self.cracked, save_list=self.result_gt, output=outputs.get('gt'))
+        else:
+            self.render_gt(filepath=self.path, camera=camera, crackflag=self.cracked, save_list=self.result_gt,
+                           output=outputs.get('gt'))
 
         # render depth
-        # TODO: NASTY HARDCODING HERE
-        depth_path = os.path.join('res/depth' + str(self.result_depth_counter) + '.exr')
         self.render_depth(filepath=depth_path, camera=camera, save_list=self.result_depth)
         # TODO: file naming shouldn't be implemented through a counter ...
         self.result_depth_counter += 1
 
 
-    def render_stereo(self, cameraLeft, cameraRight):
+    def render_stereo(self, cameraLeft, cameraRight, outputs=None, outputs_right=None):
+        # outputs and outputs_right as in render, for the left and the right camera
+        outputs = {} if outputs is None else outputs
+        outputs_right = {} if outputs_right is None else outputs_right
         bpy.data.scenes['Scene'].frame_end = self.frames
         bpy.data.scenes['Scene'].render.filepath = self.path
         bpy.data.scenes['Scene'].cycles.samples = self.samples
@@ -77,34 +141,57 @@ class RenderManager():
         bpy.data.scenes['Scene'].render.tile_x = self.tilesize
         bpy.data.scenes['Scene'].render.tile_y = self.tilesize
 
+        # TODO: NASTY HARDCODING HERE
+        # TODO: that's because the save list isn't used and saving handled outside but inside the function -> refactor!
+        depth_path = outputs.get(
+            'depth', os.path.join('res/depth' + str(self.result_depth_counter) + '.' + self.depth_format))
+        depth_path_right = outputs_right.get(
+            'depth', os.path.join('res/depth' + str(self.result_depth_counter) + '_right.' + self.depth_format))
+
+        if self.single_pass:
+            self.render_all(cameraLeft, self.result_imgs, self.result_normals, self.result_gt, depth_path,
+                            self.result_depth, outputs=outputs)
+            self.render_all(cameraRight, self.result_imgs_right, self.result_normals_right, self.result_gt_right,
+                            depth_path_right, self.result_depth_right, outputs=outputs_right)
+            self.result_depth_counter += 1
+            return
+
         # render color image left
-        self.render_img(filepath=self.path, camera=cameraLeft, save_list=self.result_imgs)
+        self.render_img(filepath=self.path, camera=cameraLeft, save_list=self.result_imgs,
+                        output=outputs.get('color'))
         # render color image right
-        self.render_img(filepath=self.path, camera=cameraRight, save_list=self.result_imgs_right)
+        self.render_img(filepath=self.path, camera=cameraRight, save_list=self.result_imgs_right,
+                        output=outputs_right.get('color'))
 
         # render groundtruth
-        self.render_gt(filepath=self.path, camera=cameraLeft, crackflag=self.cracked, save_list=self.result_gt)
-        # render groundtrugh right
-        self.render_gt(filepath=self.path, camera=cameraRight, crackflag=self.cracked, save_list=self.result_gt_right)
+        if self.uv_lookup:
+            self.lookup_gt(camera=cameraLeft, crackflag=self.cracked, save_list=self.result_gt,
+                           output=outputs.get('gt'))
+            self.lookup_gt(camera=cameraRight, crackflag=self.cracked, save_list=self.result_gt_right,
+                           output=outputs_right.get('gt'))
+        else:
+            self.render_gt(filepath=self.path, camera=cameraLeft, crackflag=self.cracked, save_list=self.result_gt,
+                           output=outputs.get('gt'))
+            # render groundtrugh right
+            self.render_gt(filepath=self.path, camera=cameraRight, crackflag=self.cracked,
+                           save_list=self.result_gt_right, output=outputs_right.get('gt'))
         
         # render normalmap
-        self.render_np(filepath=self.path, camera=cameraLeft, save_list=self.result_normals)
+        self.render_np(filepath=self.path, camera=cameraLeft, save_list=self.result_normals,
+                       output=outputs.get('normal'))
         # render normalmap right
-        self.render_np(filepath=self.path, camera=cameraRight, save_list=self.result_normals_right)
+        self.render_np(filepath=self.path, camera=cameraRight, save_list=self.result_normals_right,
+                       output=outputs_right.get('normal'))
 
         # render depth
-        # TODO: NASTY HARDCODING HERE
-        # TODO: that's because the save list isn't used and saving handled outside but inside the function -> refactor!
-        depth_path = os.path.join('res/depth' + str(self.result_depth_counter) + '.exr')
         self.render_depth(depth_path, camera=cameraLeft, save_list=self.result_depth)
         # render depth right
-        depth_path_right = os.path.join('res/depth' + str(self.result_depth_counter) + '_right.exr')
         self.render_depth(filepath=depth_path_right, camera=cameraRight, save_list=self.result_depth_right)
         # TODO: file naming shouldn't be implemented through a counter ...
         self.result_depth_counter += 1
 
 
-    def render_img(self, filepath, camera, save_list):
+    def render_img(self, filepath, camera, save_list, output=None):
         # Commented code can later potentially be used to get the result directly from the CompositorLayer 
         # in principle this works fine, however it needs a GUI to work....
         # and pipe convert and reshape it into a numpy array
@@ -140,8 +227,12 @@ class RenderManager():
         self.setCamera(camera)
         # Setup shader
         self.scene.shaderDict["concrete"].set_shader_mode_color();
-        # Render call
-        bpy.ops.render.render(write_still=True)
+        # Render call, written once, in grayscale, to output if given
+        self._enable_uv_output()
+        self._render_pass('color', filepath=output)
+        self._store_uv(camera)
+        if output is not None:
+            return
         # as it seems impossible to access rendered image directly due to some blender internal
         # buffer freeing issues, we save the result to a tmp image and load it again.
         # Read rendered image from temp file to np array
@@ -163,7 +254,7 @@ class RenderManager():
         arr = arr.reshape((resolution, resolution, 4))
         misc.imsave('normaloutputfile.png', arr)
         """
-    def render_gt(self, filepath, camera, crackflag, save_list):
+    def render_gt(self, filepath, camera, crackflag, save_list, output=None):
         # Set the camera used in this rendering pass
         self.setCamera(camera)
 
@@ -171,29 +262,49 @@ class RenderManager():
             print ('crack map is generated.')
             self.scene.shaderDict["concrete"].set_shader_mode_gt();
 
-            bpy.ops.render.render(write_still=True)
-            gt = cv2.imread(filepath)
+            if output is not None:
+                # rendered to its destination and binarized in place
+                self._render_pass('gt', filepath=output)
+                cv2.imwrite(output, binarize_gt(cv2.imread(output)))
+                return
+            self._render_pass('gt')
             # binarize the ground-truth map
-            gt = gt > 0
-            gt = gt.astype(np.uint8)
-            gt *= 255
-            cv2.imwrite(filepath, gt)
-
-            save_list.append(gt)
+            save_list.append(binarize_gt(cv2.imread(filepath)))
         else:
             print ('crack map not generated.')
+            if output is not None:
+                cv2.imwrite(output, np.zeros((self.resolution, self.resolution, 3), np.uint8))
+                return
             gt = np.zeros((self.resolution, self.resolution, 3))
             save_list.append(gt)
 
-    def render_np(self, filepath, camera, save_list):
+    def lookup_gt(self, camera, crackflag, save_list, output=None, crack_maps=None):
+        # ground truth of crack_maps, by default those of the concrete shader, from the texture coordinates of the
+        # last color render of camera. replaces render_gt, so no ground truth render is needed and the ground truth
+        # follows the (anti-aliased) pixel filter of the color render.
+        if crackflag:
+            if crack_maps is None:
+                crack_maps = self.scene.shaderDict["concrete"].crack_maps
+            gt = cv2.cvtColor(uv_ground_truth(self.uv[camera.name], crack_maps), cv2.COLOR_GRAY2BGR)
+        else:
+            gt = np.zeros((self.resolution, self.resolution, 3), np.uint8)
+        if output is not None:
+            cv2.imwrite(output, gt)
+        else:
+            save_list.append(gt)
+
+    def render_np(self, filepath, camera, save_list, output=None):
         # Set the camera used in this rendering pass
         self.setCamera(camera)
 
         # Setup shader
         self.scene.shaderDict["concrete"].set_shader_mode_normal()
 
+        if output is not None:
+            self._render_pass('normal', filepath=output)
+            return
         # Render call
-        bpy.ops.render.render(write_still=True)
+        self._render_pass('normal')
 
         # Read rendered image from temp file to np array
         res = cv2.imread(filepath)
@@ -212,12 +323,14 @@ class RenderManager():
         # set render file format to .exr
         bpy.data.scenes["Scene"].render.image_settings.file_format = "OPEN_EXR"
         
-        # Render call
-        bpy.ops.render.render(write_still=True)
-
-        # load .exr and convert to numpy, save as numpy
-        # TODO: get python3.5m pip to load openexr and then convert to numpy to add to list
-        os.rename("tmp/tmp.exr", filepath)
+        if self.depth_format == 'exr':
+            # Render call, written directly to filepath
+            self._render_pass('depth', filepath=filepath)
+        else:
+            # Render call, decoded from a temporary file and written in the compact format
+            exr_path = os.path.splitext(self.path)[0] + '.exr'
+            self._render_pass('depth', filepath=exr_path)
+            self._store_depth(self.saveOpenEXR2NP(exr_path), filepath, save_list)
 
         # link scene composition node to color
         self.scene.compositionNodeTreeLinks.new(
@@ -228,9 +341,190 @@ class RenderManager():
         # set render file format to .png
         bpy.data.scenes["Scene"].render.image_settings.file_format = "PNG"
 
+    def profile(self, name):
+        # the color pass renders with --samples and the scene's settings, the auxiliary passes with the profiles of
+        # DEFAULT_PROFILES
+        if name in self.profiles:
+            return self.profiles[name]
+        if name == 'color':
+            return RenderProfile(samples=self.samples)
+        return DEFAULT_PROFILES[name]
+
+    def _render_pass(self, name, filepath=None):
+        # renders with the profile of pass name and restores the scene's settings afterwards. the result is written
+        # to self.path or, in the color mode of OUTPUT_COLOR_MODES, to filepath
+        scene = bpy.data.scenes['Scene']
+        settings = scene.render.image_settings
+        color_mode = settings.color_mode
+        if filepath is not None:
+            scene.render.filepath = filepath
+            settings.color_mode = OUTPUT_COLOR_MODES.get(name, color_mode)
+        if self.measure_savings and name != 'color' and name not in self.baseline_times:
+            previous = self.profile('color').apply(scene)
+            start = time.time()
+            bpy.ops.render.render(write_still=True)
+            self.baseline_times[name] = time.time() - start
+            previous.apply(scene)
+
+        previous = self.profile(name).apply(scene)
+        start = time.time()
+        bpy.ops.render.render(write_still=True)
+        self.pass_times.setdefault(name, []).append(time.time() - start)
+        previous.apply(scene)
+        scene.render.filepath = self.path
+        settings.color_mode = color_mode
+
+    def report_pass_times(self):
+        # mean render time per pass and, if measured, the time saved against rendering it with the color profile
+        lines = []
+        for name, times in sorted(self.pass_times.items()):
+            mean = sum(times) / len(times)
+            line = "{}: {:.2f} s per render ({} renders)".format(name, mean, len(times))
+            if name in self.baseline_times:
+                saved = self.baseline_times[name] - mean
+                line += ", saves {:.2f} s per render, {:.1f} s in total against the color profile".format(
+                    saved, saved * len(times))
+            lines.append(line)
+        return lines
+
+    def setup_single_pass(self):
+        # One render job per camera produces all outputs instead of four, from the passes of blender's default render
+        # layer, so the scene is synced once: the concrete material in color and normal mode (see
+        # MasterShader.set_shader_mode_color_and_normal) emits the normal map to camera rays, the emission pass is the
+        # normal map and the combined pass minus the emission pass the color image. depth is the Z pass. A file
+        # output node of the compositor writes all of them at once. the ground truth is looked up at the texture
+        # coordinates of the UV pass with uv_lookup (see lookup_gt), otherwise it is rendered on its own.
+        scene = bpy.data.scenes['Scene']
+        layer = scene.render.layers['RenderLayer']
+        layer.use_pass_z = True
+        layer.use_pass_emit = True
+
+        tree = self.scene.compositionNodeTree
+        output = tree.nodes.new('CompositorNodeOutputFile')
+        output.name = SINGLE_PASS_OUTPUT
+        output.base_path = os.path.abspath(os.path.dirname(self.path))
+        output.format.file_format = 'PNG'
+        output.format.color_mode = 'RGB'
+        output.file_slots.clear()
+        for name in ('color', 'depth', 'normal'):
+            output.file_slots.new(name + '_')
+        # the files are moved to their destination as they are, see render_all
+        output.file_slots['color_'].use_node_format = False
+        output.file_slots['color_'].format.file_format = 'PNG'
+        output.file_slots['color_'].format.color_mode = OUTPUT_COLOR_MODES['color']
+        depth_format = output.file_slots['depth_'].format
+        output.file_slots['depth_'].use_node_format = False
+        depth_format.file_format = 'OPEN_EXR'
+        depth_format.color_depth = '32'
+
+        main = tree.nodes['Render Layers']
+        without_emission = tree.nodes.new('CompositorNodeMixRGB')
+        without_emission.name = 'Color Without Emission'
+        without_emission.blend_type = 'SUBTRACT'
+        without_emission.inputs[0].default_value = 1.0
+        self.scene.compositionNodeTreeLinks.new(main.outputs['Image'], without_emission.inputs[1])
+        self.scene.compositionNodeTreeLinks.new(main.outputs['Emit'], without_emission.inputs[2])
+        self.scene.compositionNodeTreeLinks.new(without_emission.outputs['Image'], output.inputs['color_'])
+        self.scene.compositionNodeTreeLinks.new(main.outputs['Emit'], output.inputs['normal_'])
+        self.scene.compositionNodeTreeLinks.new(main.outputs['Depth'], output.inputs['depth_'])
+
+        self._single_pass_ready = True
+
+    def setup_uv_output(self):
+        # Color renders also write the texture coordinates of every pixel (the UV pass of cycles, which is filtered
+        # like the image) to an OpenEXR file, from which lookup_gt builds the ground truth of any crack map without
+        # rendering it. Assumes the concrete covers the whole image, as it does in the concrete scenes.
+        bpy.data.scenes['Scene'].render.layers['RenderLayer'].use_pass_uv = True
+
+        tree = self.scene.compositionNodeTree
+        output = tree.nodes.new('CompositorNodeOutputFile')
+        output.name = UV_OUTPUT
+        output.base_path = os.path.abspath(os.path.dirname(self.path))
+        output.format.file_format = 'OPEN_EXR'
+        # half floats resolve only 2048 steps below 1
+        output.format.color_depth = '32'
+        output.format.color_mode = 'RGB'
+        output.file_slots.clear()
+        output.file_slots.new('uv_')
+        self.scene.compositionNodeTreeLinks.new(tree.nodes['Render Layers'].outputs['UV'], output.inputs['uv_'])
+        # only color renders write the file
+        output.mute = True
+
+        self._uv_output_ready = True
+
+    def _enable_uv_output(self):
+        if not self.uv_lookup:
+            return
+        if not self._uv_output_ready:
+            self.setup_uv_output()
+        self.scene.compositionNodeTree.nodes[UV_OUTPUT].mute = False
+
+    def _store_uv(self, camera):
+        # reads the texture coordinates written by the last color render, rendered with camera
+        if not self.uv_lookup:
+            return
+        self.scene.compositionNodeTree.nodes[UV_OUTPUT].mute = True
+        # u and v are the red and green channel
+        self.uv[camera.name] = read_exr(self._output_file(UV_OUTPUT, 'uv', '.exr'))[..., 2:0:-1]
+
+    def _output_file(self, node, name, extension):
+        # file written by the file output node for slot name in the current frame
+        output = self.scene.compositionNodeTree.nodes[node]
+        return os.path.join(output.base_path,
+                            name + '_' + '%04d' % bpy.data.scenes['Scene'].frame_current + extension)
+
+    def _single_pass_file(self, name, extension):
+        return self._output_file(SINGLE_PASS_OUTPUT, name, extension)
+
+    def render_all(self, camera, img_list, normal_list, gt_list, depth_path, depth_list, outputs=None):
+        # outputs as in render: the files of these passes are moved to their destination instead of being read
+        if not self._single_pass_ready:
+            self.setup_single_pass()
+        shader = self.scene.shaderDict["concrete"]
+        shader.set_shader_mode_color_and_normal()
+
+        # Set the camera used in this rendering pass
+        self.setCamera(camera)
+        # Render call, the file output node writes all outputs. the normal map gets the samples of the color image.
+        self._enable_uv_output()
+        output_node = self.scene.compositionNodeTree.nodes[SINGLE_PASS_OUTPUT]
+        output_node.mute = False
+        previous = self.profile('color').apply(bpy.data.scenes['Scene'])
+        start = time.time()
+        bpy.ops.render.render()
+        self.pass_times.setdefault('single', []).append(time.time() - start)
+        previous.apply(bpy.data.scenes['Scene'])
+        # a ground truth render must not overwrite the files
+        output_node.mute = True
+        self._store_uv(camera)
+        shader.set_shader_mode_color()
+
+        outputs = {} if outputs is None else outputs
+        if 'color' in outputs:
+            os.replace(self._single_pass_file('color', '.png'), outputs['color'])
+        else:
+            img_list.append(cv2.imread(self._single_pass_file('color', '.png'), 0))
+        if 'normal' in outputs:
+            os.replace(self._single_pass_file('normal', '.png'), outputs['normal'])
+        else:
+            normal_list.append(cv2.imread(self._single_pass_file('normal', '.png')))
+        if self.uv_lookup:
+            self.lookup_gt(camera, self.cracked, gt_list, output=outputs.get('gt'))
+        if self.depth_format == 'exr':
+            os.replace(self._single_pass_file('depth', '.exr'), depth_path)
+        else:
+            self._store_depth(self.saveOpenEXR2NP(self._single_pass_file('depth', '.exr')), depth_path, depth_list)
+        if not self.uv_lookup:
+            self.render_gt(filepath=self.path, camera=camera, crackflag=self.cracked, save_list=gt_list,
+                           output=outputs.get('gt'))
+
     def saveOpenEXR2NP(self, path):
-        # TODO
-        return
+        # depth of an OpenEXR file rendered by blender as float32 array
+        return read_depth(path)
+
+    def _store_depth(self, depth, filepath, save_list):
+        write_depth(filepath, depth, self.depth_format)
+        save_list.append(depth)
 
     def setPath(self, path):
         self.path = path
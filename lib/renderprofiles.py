@@ -0,0 +1,80 @@
+import json
+
+# cycles scene settings of every profile setting
+CYCLES_SETTINGS = {
+    'samples': ('samples',),
+    'max_bounces': ('max_bounces',),
+    'caustics': ('caustics_reflective', 'caustics_refractive'),
+    'clamp_direct': ('sample_clamp_direct',),
+    'clamp_indirect': ('sample_clamp_indirect',),
+    'texture_limit': ('texture_limit_render',),
+    'filter_type': ('pixel_filter_type',),
+    'filter_width': ('filter_width',),
+}
+
+
+class RenderProfile:
+    # Cycles quality settings of one render pass. Settings left at None keep the value of the scene.
+    #   samples         samples per pixel
+    #   max_bounces     maximum number of light path bounces
+    #   caustics        whether reflective and refractive caustics are traced
+    #   clamp_direct    clamp of direct and indirect light samples, 0 disables clamping
+    #   clamp_indirect
+    #   texture_limit   maximum texture size, 'OFF' or e.g. '2048'
+    #   filter_type     pixel filter, 'BOX', 'GAUSSIAN' or 'BLACKMAN_HARRIS', and its width in pixels
+    #   filter_width
+    #   use_simplify    simplify of the scene, which cycles needs to apply texture_limit. enabled with texture_limit.
+    def __init__(self, samples=None, max_bounces=None, caustics=None, clamp_direct=None, clamp_indirect=None,
+                 texture_limit=None, filter_type=None, filter_width=None, use_simplify=None):
+        self.samples = samples
+        self.max_bounces = max_bounces
+        self.caustics = caustics
+        self.clamp_direct = clamp_direct
+        self.clamp_indirect = clamp_indirect
+        self.texture_limit = texture_limit
+        self.filter_type = filter_type
+        self.filter_width = filter_width
+        self.use_simplify = use_simplify
+
+    def settings(self):
+        return dict((name, getattr(self, name)) for name in CYCLES_SETTINGS if getattr(self, name) is not None)
+
+    def apply(self, scene):
+        # sets the profile on scene and returns the profile of the replaced values, to restore them afterwards
+        previous = RenderProfile()
+        for name, value in self.settings().items():
+            attributes = CYCLES_SETTINGS[name]
+            setattr(previous, name, getattr(scene.cycles, attributes[0]))
+            for attribute in attributes:
+                setattr(scene.cycles, attribute, value)
+
+        use_simplify = self.use_simplify
+        if use_simplify is None and self.texture_limit is not None:
+            use_simplify = True
+        if use_simplify is not None:
+            previous.use_simplify = scene.render.use_simplify
+            scene.render.use_simplify = use_simplify
+        return previous
+
+
+# the normal and ground truth passes render emission shaders only, which need no bounces, caustics or clamping.
+# they keep the samples and pixel filter of the scene, fewer samples would alias the saved maps. textures keep their
+# size, the passes show them pixel by pixel.
+EMISSION_PROFILE = RenderProfile(max_bounces=0, caustics=False, clamp_direct=0.0, clamp_indirect=0.0)
+# cycles writes the depth pass in the first sample only, further samples do not change it
+DEPTH_PROFILE = RenderProfile(samples=1, max_bounces=0, caustics=False, clamp_direct=0.0, clamp_indirect=0.0)
+# profiles of the auxiliary passes unless set otherwise. e.g. {"normal": {"samples": 1, "filter_type": "BOX",
+# "filter_width": 1.0}} in a profiles file trades the anti-aliasing of the normal maps for render time.
+DEFAULT_PROFILES = {'normal': EMISSION_PROFILE, 'gt': EMISSION_PROFILE, 'depth': DEPTH_PROFILE}
+# passes of RenderManager
+PASSES = ('color', 'normal', 'gt', 'depth')
+
+
+def load_render_profiles(path):
+    # profiles from a JSON file {"<pass>": {"<setting>": value, ...}, ...}
+    with open(path) as f:
+        profiles = json.load(f)
+    unknown = set(profiles) - set(PASSES)
+    if unknown:
+        raise ValueError("unknown render passes in " + path + ": " + ", ".join(sorted(unknown)))
+    return dict((name, RenderProfile(**settings)) for name, settings in profiles.items())
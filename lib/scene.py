@@ -77,5 +77,7 @@ class Scene:
                 for lamp in bpy.data.lamps:
                     bpy.data.lamps.remove(lamp, do_unlink=True)
 
-    def update(self, heighttexpath):
+    def update(self, rng=None, crack_seed=None):
+        # rng is the random stream of the current sample and crack_seed the seed of its crack,
+        # see lib/randomstreams.py
         pass
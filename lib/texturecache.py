@@ -0,0 +1,53 @@
+import collections
+
+import bpy
+
+
+def image_nbytes(image):
+    # memory of a loaded image: blender keeps byte images as 4 bytes and float images (e.g. 16 bit PNGs) as 4 floats
+    # per pixel, whatever the number of channels of the file
+    width, height = image.size
+    return width * height * (16 if image.is_float else 4)
+
+
+class TextureCache:
+    # Images loaded from disk, keyed by file path, so texture sets used again are neither decoded again nor loaded
+    # into duplicate datablocks. Once the images exceed max_bytes the least recently used ones are removed from
+    # bpy.data. Cached images carry a fake user, so purging orphaned images does not remove idle ones.
+    def __init__(self, max_bytes=4 * 1024**3):
+        self.max_bytes = max_bytes
+        # path -> (image name, bytes), least recently used first
+        self._images = collections.OrderedDict()
+
+    @property
+    def nbytes(self):
+        return sum(nbytes for _, nbytes in self._images.values())
+
+    def load(self, path):
+        # the image of path, loaded only if it is not cached
+        if path in self._images:
+            name, nbytes = self._images.pop(path)
+            image = bpy.data.images.get(name)
+            if image is not None:
+                self._images[path] = (name, nbytes)
+                return image
+
+        image = bpy.data.images.load(filepath=path)
+        image.use_fake_user = True
+        self._images[path] = (image.name, image_nbytes(image))
+        return image
+
+    def evict(self, keep=()):
+        # removes least recently used images until the cache fits into max_bytes, never those of the paths in keep
+        total = self.nbytes
+        for path in list(self._images):
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            name, nbytes = self._images.pop(path)
+            image = bpy.data.images.get(name)
+            if image is not None:
+                image.use_fake_user = False
+                bpy.data.images.remove(image, do_unlink=True)
+            total -= nbytes
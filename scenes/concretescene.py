@@ -9,7 +9,8 @@ from lib.mastershader import MasterShader
 from lib.meshmodifiers import MeshDisplacement
 
 class ConcreteScene(Scene):
-    def __init__(self, resolution, is_cracked, path):
+    def __init__(self, resolution, is_cracked, path, crack_cache=None, crack_bank=None, crack_params=None,
+                 crack_depth=None, crack_prefetcher=None, texture_cache=None):
         # attributes of the scene used in setup need to be called before parent init!
         # otherwise they are not known to the overriding function!
         self.resolution = resolution
@@ -21,6 +22,13 @@ class ConcreteScene(Scene):
         self.DisplacedCrack = None
 
         self.pathname = path
+
+        self.crackCache = crack_cache
+        self.crackBank = crack_bank
+        self.crackParams = crack_params
+        self.crackDepth = crack_depth
+        self.crackPrefetcher = crack_prefetcher
+        self.textureCache = texture_cache
         super(ConcreteScene, self).__init__()
 
     # Override(Scene)
@@ -110,9 +118,13 @@ class ConcreteScene(Scene):
         shadername = "concrete"
 
         if self.isCracked:
-            shader = CrackShader(shadername, albedo_path, roughness_path, normal_path, height_path, self.resolution)
+            shader = CrackShader(shadername, albedo_path, roughness_path, normal_path, height_path, self.resolution,
+                                 crack_cache=self.crackCache, crack_bank=self.crackBank,
+                                 crack_params=self.crackParams, crack_depth=self.crackDepth,
+                                 crack_prefetcher=self.crackPrefetcher, texture_cache=self.textureCache)
         else:
-            shader = MasterShader(shadername, albedo_path, roughness_path, normal_path, height_path)
+            shader = MasterShader(shadername, albedo_path, roughness_path, normal_path, height_path,
+                                  texture_cache=self.textureCache)
 
         self.shaderDict[shadername] = shader
 
@@ -127,24 +139,27 @@ class ConcreteScene(Scene):
         shader.apply_to_blender_object(bpy.data.objects['Grid'])
 
     # Override(Scene)
-    def update(self):
+    def update(self, rng=None, crack_seed=None):
+        # all random values of a sample are drawn from its own stream rng, see lib/randomstreams.py
+        if rng is None:
+            rng = np.random
 
         # Update Sun rotation
-        rand_sun_rotation_y = np.random.uniform(-30, 30)
+        rand_sun_rotation_y = rng.uniform(-30, 30)
         bpy.data.objects['Sun'].rotation_euler = [59 * math.pi / 180, rand_sun_rotation_y, 0.0]
 
         for key in self.shaderDict:
             try:
                 # TODO: returning height texture path so that it can be used for displacement of mesh. This is an imroper fix.
                 if self.isCracked:
-                    heightTexPath, img_tex_heights = self.shaderDict[key].sample_texture()
+                    heightTexPath, img_tex_heights = self.shaderDict[key].sample_texture(rng, crack_seed)
                     self.DisplacedMesh.displace(heightTexPath, disp_strength=0.05)
                     # Negative value is given for displacement strength of crack because displacement has to be in
                     # the opposite direction of the normals in object coordinates.
-                    rand_disp_strenght = np.random.uniform(0.03, 0.05)
+                    rand_disp_strenght = rng.uniform(0.03, 0.05)
                     self.DisplacedCrack.displace(img_tex_heights, disp_strength=-rand_disp_strenght)
                 else:
-                    heightTexPath = self.shaderDict[key].sample_texture()
+                    heightTexPath = self.shaderDict[key].sample_texture(rng)
                     self.DisplacedMesh.displace(heightTexPath, disp_strength=0.05)
             except Exception:
                 pass
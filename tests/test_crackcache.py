@@ -0,0 +1,28 @@
+import os
+
+from lib.crackcache import CrackCache
+
+
+def test_entries_larger_than_the_cache_are_kept_until_the_next_store(tmpdir):
+    cache = CrackCache(str(tmpdir), max_bytes=1000)
+    for seed in range(6):
+        cache.get_or_generate(seed, 256, 5)
+        entries = cache.entries()
+        assert [os.path.basename(entry) for _, _, entry in entries] == [CrackCache.key(seed, 256, 5)]
+        assert entries[0][1] > cache.max_bytes
+    assert cache.load(CrackCache.key(5, 256, 5)) is not None
+
+
+def test_least_recently_used_entries_are_evicted(tmpdir):
+    cache = CrackCache(str(tmpdir))
+    for seed in range(3):
+        cache.get_or_generate(seed, 128, 4)
+    sizes = sorted(size for _, size, _ in cache.entries())
+    # room for the two largest entries
+    cache.max_bytes = sizes[1] + sizes[2]
+    for seed, mtime in ((0, 1), (1, 3), (2, 2)):
+        os.utime(os.path.join(str(tmpdir), CrackCache.key(seed, 128, 4), 'meta.json'), (mtime, mtime))
+    cache.evict()
+    assert cache.load(CrackCache.key(0, 128, 4)) is None
+    assert cache.load(CrackCache.key(1, 128, 4)) is not None
+    assert cache.load(CrackCache.key(2, 128, 4)) is not None
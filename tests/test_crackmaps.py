@@ -0,0 +1,19 @@
+import numpy
+import pytest
+
+from lib.crackmaps import intensity_max
+from lib.fractalcracks import generate_crack_maps
+
+
+@pytest.mark.parametrize('sparse', (True, False))
+@pytest.mark.parametrize('seed', range(2, 7))
+def test_lookup_at_pixel_centers_equals_crack(seed, sparse):
+    maps = generate_crack_maps(256, 5, sparse=sparse, rng=numpy.random.RandomState(seed))
+    # identity texture coordinates: every image pixel sees the center of the map pixel at its row and column
+    rows, columns = numpy.mgrid[0:256, 0:256]
+    uv = numpy.stack([(columns + 0.5) / 256, (rows + 0.5) / 256], axis=-1)
+    crack = maps.lookup(uv)
+    dense = maps.densify().crack
+    assert (dense > 0).sum() > 0
+    numpy.testing.assert_array_equal(crack > 0, dense > 0)
+    numpy.testing.assert_allclose(crack, dense / float(intensity_max(dense.dtype)), atol=1e-6)
@@ -0,0 +1,20 @@
+import numpy
+
+from lib.crackprefetcher import CrackPrefetcher, generate_crack_maps_for_seed
+
+
+def test_prefetching_continues_after_skipped_samples():
+    prefetcher = CrackPrefetcher(range(10), 64, 3, processes=2, queue_size=2)
+    try:
+        # a seed that is not upcoming leaves the queue (0, 1) alone
+        assert prefetcher.get(100) is None
+        # 3 is beyond the queue, prefetching restarts after it
+        assert prefetcher.get(3) is None
+        crack_maps = prefetcher.get(4)
+        numpy.testing.assert_array_equal(crack_maps.crack, generate_crack_maps_for_seed(4, 64, 3).crack)
+        # 6 is queued behind 5, which is dropped
+        assert prefetcher.get(6) is not None
+        for seed in range(7, 10):
+            assert prefetcher.get(seed) is not None
+    finally:
+        prefetcher.close()
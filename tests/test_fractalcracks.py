@@ -0,0 +1,50 @@
+import cv2
+import numpy
+import pytest
+
+from lib.fractalcracks import WidthProfile, construct_matrix, generate_crack_maps, get_crack_line_params, koch, \
+    rasterize_polylines
+
+CRACK_PARAMS = ({}, {'max_thickness': 3}, {'width_profile': WidthProfile(1, 4)},
+                {'num_cracks': 2, 'num_branches': 2})
+
+
+@pytest.mark.parametrize('params', CRACK_PARAMS)
+@pytest.mark.parametrize('seed', range(8))
+def test_sparse_maps_equal_dense_maps(seed, params):
+    sparse = generate_crack_maps(384, 5, sparse=True, rng=numpy.random.RandomState(seed), **params).densify()
+    dense = generate_crack_maps(384, 5, sparse=False, rng=numpy.random.RandomState(seed), **params).densify()
+    numpy.testing.assert_array_equal(sparse.crack, dense.crack)
+    numpy.testing.assert_array_equal(sparse.normals, dense.normals)
+
+
+def cv2_construct_matrix(TOTALWIDTH, points):
+    # the original per segment cv2.line drawing of construct_matrix
+    max_y = numpy.max(points[:, 1])
+    min_x = numpy.min(points[:, 0])
+    min_y = numpy.min(points[:, 1])
+    img = numpy.zeros((TOTALWIDTH, TOTALWIDTH), numpy.uint8)
+    pad = (TOTALWIDTH - (max_y - min_y)) / 2
+    for pidx, p in enumerate(points[:-1]):
+        strength, _ = get_crack_line_params(len(points), pidx, 1)
+        cv2.line(img, (int(p[0] - min_x), int(pad + p[1] - min_y)),
+                 (int(points[pidx + 1, 0] - min_x), int(pad + points[pidx + 1, 1] - min_y)), int(strength), 1)
+    return img
+
+
+def test_segments_equal_cv2_line():
+    # end points inside and outside of the canvas, which cv2.line clips
+    rng = numpy.random.RandomState(0)
+    for _ in range(2000):
+        start, end = rng.randint(-80, 150, (2, 2))
+        expected = numpy.zeros((48, 64), numpy.uint8)
+        cv2.line(expected, tuple(int(v) for v in start), tuple(int(v) for v in end), 255, 1)
+        drawn = rasterize_polylines((48, 64), numpy.array([[start, end]], dtype=float))[0]
+        numpy.testing.assert_array_equal(drawn > 0, expected > 0)
+
+
+@pytest.mark.parametrize('depth', range(2, 8))
+def test_construct_matrix_equals_cv2_line_loop(depth):
+    for seed in range(5):
+        points = koch(depth, 256, numpy.random.RandomState(seed))
+        numpy.testing.assert_array_equal(construct_matrix(256, points), cv2_construct_matrix(256, points))
@@ -0,0 +1,19 @@
+import os
+
+import cv2
+import numpy
+
+from lib.crackmaps import CrackMaps
+from lib.fractalcracks import generate_crack_maps
+from lib.imageupload import float_to_bytes, write_pixels_png
+
+
+def test_png_keeps_crack_intensity_in_alpha(tmpdir):
+    maps = generate_crack_maps(128, 4, rng=numpy.random.RandomState(0))
+    for name in CrackMaps.MAP_NAMES:
+        rgba = maps.to_rgba(name)
+        path = os.path.join(str(tmpdir), name + '.png')
+        write_pixels_png(path, rgba)
+        # back to blender's layout: rows bottom to top, RGBA
+        pixels = cv2.cvtColor(cv2.imread(path, cv2.IMREAD_UNCHANGED), cv2.COLOR_BGRA2RGBA)[::-1]
+        numpy.testing.assert_array_equal(pixels, float_to_bytes(rgba))
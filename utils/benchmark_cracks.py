@@ -0,0 +1,254 @@
+# Micro-benchmarks of the crack generation pipeline in lib/fractalcracks.py. Runs with plain python, no blender needed.
+# Every stage is timed (best and mean of --repeat runs) and its peak memory is measured with tracemalloc in one extra
+# run. Stages that only depend on the resolution or only on the depth are run once per resolution or depth.
+# Results are written as JSON, together with the git commit and library versions, so runs of different commits can be
+# compared. --tree benchmarks the lib/ of another checkout with this script, e.g. a worktree of the original code:
+#   git worktree add ../baseline <other commit>
+#   python utils/benchmark_cracks.py --tree ../baseline -o before.json
+#   python utils/benchmark_cracks.py -o after.json --compare before.json
+# Stages whose functions the benchmarked tree does not have are skipped. generate_fractal_cracks, the entry point every
+# commit has, is always measured, so it can be compared against any commit.
+import argparse
+import importlib
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RESOLUTIONS = (512, 1024, 2048, 4096, 8192)
+DEPTHS = (5, 6, 7, 8, 9, 10)
+
+# lib.fractalcracks of the benchmarked tree, see load
+fc = None
+
+
+def load(tree):
+    # imports lib/fractalcracks.py of the checkout at tree instead of the one next to this script
+    global fc
+    sys.path.insert(0, os.path.abspath(tree))
+    fc = importlib.import_module('lib.fractalcracks')
+
+
+def seeded(function):
+    # function called as function(rng, *args). older commits draw from the global numpy.random instead of taking a
+    # RandomState, it is seeded from rng for them.
+    if 'rng' in inspect.signature(function).parameters:
+        return lambda rng, *args: function(*args, rng=rng)
+
+    def call(rng, *args):
+        np.random.seed(rng.randint(2**31))
+        return function(*args)
+    return call
+
+
+def center_line_depth(resolution):
+    # about one pixel per segment, the depth adaptive_depth picks for 512 to 8192. fixed here so every commit gets the
+    # same inputs.
+    return int(np.log2(resolution)) // 2 + 1
+
+
+# every stage is (name, uses resolution, uses depth, functions of lib.fractalcracks it needs, setup).
+# setup(resolution, depth) prepares the inputs outside of the measurement and returns the function to measure, which
+# takes a RandomState.
+def setup_koch(resolution, depth):
+    koch = seeded(fc.koch)
+    return lambda rng: koch(rng, depth, 1024)
+
+
+def setup_construct_matrix(resolution, depth):
+    points = seeded(fc.koch)(np.random.RandomState(0), depth, resolution)
+    return lambda rng: fc.construct_matrix(resolution, points)
+
+
+def setup_rotate_translate(resolution, depth):
+    points = seeded(fc.koch)(np.random.RandomState(0), depth, resolution)
+    pixels = fc.place_points(resolution, points[np.newaxis])
+    random_rotate, random_translate = seeded(fc.random_rotate), seeded(fc.random_translate)
+    return lambda rng: random_translate(rng, random_rotate(rng, pixels, resolution), resolution)
+
+
+def center_line(resolution):
+    # rasterized crack as input of the resolution dependent stages
+    points = seeded(fc.koch)(np.random.RandomState(0), center_line_depth(resolution), resolution)
+    return fc.construct_matrix(resolution, points)
+
+
+def setup_widen_line(resolution, depth):
+    img = center_line(resolution)
+    widen_line = seeded(fc.widen_line)
+    return lambda rng: widen_line(rng, img)
+
+
+def setup_widen_line_distance(resolution, depth):
+    points = seeded(fc.koch)(np.random.RandomState(0), center_line_depth(resolution), resolution)
+    img, position = fc.rasterize_polylines(resolution, np.trunc(fc.place_points(resolution, points[np.newaxis])),
+                                           positions=True)
+    profile = fc.WidthProfile()
+    return lambda rng: fc.widen_line_distance(img[0], position[0], profile)
+
+
+def setup_calculate_normals(resolution, depth):
+    height = seeded(fc.widen_line)(np.random.RandomState(0), center_line(resolution)) / 255.0
+    return lambda rng: fc.calculate_normals(height)
+
+
+def setup_generate_crack_maps(resolution, depth):
+    generate_crack_maps = seeded(fc.generate_crack_maps)
+    return lambda rng: generate_crack_maps(rng, resolution, depth)
+
+
+def setup_generate_fractal_cracks(resolution, depth):
+    generate_fractal_cracks = seeded(fc.generate_fractal_cracks)
+    return lambda rng: generate_fractal_cracks(rng, resolution, depth)
+
+
+STAGES = (
+    ('koch', False, True, ('koch',), setup_koch),
+    ('construct_matrix', True, True, ('koch', 'construct_matrix'), setup_construct_matrix),
+    ('random_rotate_translate', True, True, ('place_points',), setup_rotate_translate),
+    ('widen_line', True, False, ('widen_line',), setup_widen_line),
+    ('widen_line_distance', True, False, ('rasterize_polylines', 'place_points', 'WidthProfile',
+                                          'widen_line_distance'), setup_widen_line_distance),
+    ('calculate_normals', True, False, ('widen_line', 'calculate_normals'), setup_calculate_normals),
+    ('generate_crack_maps', True, True, ('generate_crack_maps',), setup_generate_crack_maps),
+    ('generate_fractal_cracks', True, True, ('generate_fractal_cracks',), setup_generate_fractal_cracks),
+)
+
+
+def available(stages):
+    # stages the benchmarked tree has all functions of
+    result = []
+    for stage in stages:
+        missing = [name for name in stage[3] if not hasattr(fc, name)]
+        if missing:
+            print("skipping " + stage[0] + ", lib/fractalcracks.py has no " + ", ".join(missing))
+        else:
+            result.append(stage)
+    return result
+
+
+def measure(function, repeat, seed):
+    times = []
+    for r in range(repeat):
+        rng = np.random.RandomState([seed, r])
+        start = time.perf_counter()
+        function(rng)
+        times.append(time.perf_counter() - start)
+
+    # separate run for the memory, tracemalloc slows down allocations. numpy reports its buffers to tracemalloc.
+    rng = np.random.RandomState([seed, repeat])
+    tracemalloc.start()
+    function(rng)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'seconds': min(times), 'mean_seconds': sum(times) / len(times), 'peak_bytes': peak}
+
+
+def git_commit(tree):
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=tree,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def key(result):
+    return result['stage'], result['resolution'], result['depth']
+
+
+def run(args):
+    stages = available([stage for stage in STAGES if args.stages is None or stage[0] in args.stages])
+    results = []
+    done = set()
+    for resolution in args.resolutions:
+        for depth in args.depths:
+            for name, uses_resolution, uses_depth, requires, setup in stages:
+                result = {'stage': name, 'resolution': resolution if uses_resolution else None,
+                          'depth': depth if uses_depth else None}
+                if key(result) in done:
+                    continue
+                done.add(key(result))
+
+                try:
+                    result.update(measure(setup(resolution, depth), args.repeat, args.seed))
+                except Exception as e:
+                    # e.g. an old commit that does not run with the installed numpy or opencv
+                    print("{:<24} {:>6} {:>6} failed: {}".format(name, str(result['resolution']),
+                                                                 str(result['depth']), repr(e)))
+                    continue
+                results.append(result)
+                print_result(result)
+    return results
+
+
+def print_result(result, baseline=None):
+    line = "{:<24} {:>6} {:>6} {:>10.4f} s {:>10.1f} MB".format(
+        result['stage'], str(result['resolution']), str(result['depth']), result['seconds'],
+        result['peak_bytes'] / 1024.0**2)
+    if baseline is not None:
+        line += "   {:>6.2f}x time {:>6.2f}x memory".format(
+            baseline['seconds'] / max(result['seconds'], 1e-12),
+            baseline['peak_bytes'] / float(max(result['peak_bytes'], 1)))
+    print(line)
+
+
+def compare(results, baseline_path):
+    # speedup and memory reduction relative to a baseline run, > 1 means better than the baseline
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print("")
+    print("compared to " + baseline_path + " (commit " + str(baseline.get('commit')) + "):")
+    baseline_results = dict((key(result), result) for result in baseline['results'])
+    for result in results:
+        if key(result) in baseline_results:
+            print_result(result, baseline_results[key(result)])
+
+
+def parse(argv):
+    parser = argparse.ArgumentParser(description="benchmark the stages of the crack generation")
+    parser.add_argument("-o", "--output", default="benchmark_cracks.json", metavar="Path",
+                        help="JSON file the results are written to (default benchmark_cracks.json)")
+    parser.add_argument("-res", "--resolutions", default=RESOLUTIONS, type=int, nargs="+", metavar="R",
+                        help="resolutions to benchmark (default: 512 to 8192)")
+    parser.add_argument("-d", "--depths", default=DEPTHS, type=int, nargs="+", metavar="D",
+                        help="fractal depths to benchmark (default: 5 to 10)")
+    parser.add_argument("--stages", default=None, nargs="+", choices=[stage[0] for stage in STAGES],
+                        help="stages to benchmark (default: all)")
+    parser.add_argument("-r", "--repeat", default=3, type=int, metavar="N",
+                        help="timed runs per measurement, the best is reported (default 3)")
+    parser.add_argument("--seed", default=0, type=int, metavar="SEED",
+                        help="seed of the benchmarked cracks, keep it fixed to compare runs (default 0)")
+    parser.add_argument("--compare", default=None, metavar="Path",
+                        help="JSON file of an earlier run to compare against")
+    parser.add_argument("--tree", default=dir, metavar="Path",
+                        help="checkout whose lib/ is benchmarked, e.g. a git worktree of another commit "
+                             "(default: the one of this script)")
+    return parser.parse_args(argv)
+
+
+if(__name__ == "__main__"):
+    args = parse(sys.argv[1:])
+    load(args.tree)
+
+    print("{:<24} {:>6} {:>6} {:>12} {:>13}".format('stage', 'res', 'depth', 'time', 'peak memory'))
+    results = run(args)
+
+    report = {'commit': git_commit(args.tree), 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'repeat': args.repeat,
+              'seed': args.seed, 'python': platform.python_version(), 'numpy': np.__version__,
+              'opencv': cv2.__version__, 'platform': platform.platform(), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("results written to " + args.output)
+
+    if args.compare is not None:
+        compare(results, args.compare)
@@ -0,0 +1,67 @@
+# Offline generation of a crack bank, see lib/crackbank.py. Runs with plain python, no blender needed.
+# Example (bank in shared memory, to be mapped by all blender workers of a node):
+#   python utils/build_crack_bank.py /dev/shm/cracks_2048.bank --num-cracks 5000 --resolution 2048 --depth 7
+# and render with:
+#   /path/to/blender --background --python generate.py -- --crack --crack-bank /dev/shm/cracks_2048.bank
+import argparse
+import os
+import sys
+
+import numpy as np
+
+dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not dir in sys.path:
+    sys.path.append(dir)
+
+from lib.crackbank import write_crack_bank
+from lib.fractalcracks import WidthProfile, adaptive_depth
+
+
+def parse(argv):
+    parser = argparse.ArgumentParser(description="generate a bank of crack maps into one memory-mappable file")
+    parser.add_argument("path", help="output file of the crack bank")
+    parser.add_argument("-n", "--num-cracks", default=1000, type=int, metavar="N",
+                        help="number of cracks in the bank (default 1000)")
+    parser.add_argument("-res", "--resolution", default=2048, type=int, metavar="R",
+                        help="crack map resolution, has to match the render resolution (default: 2048)")
+    parser.add_argument("-d", "--depth", default=None, type=int, metavar="D",
+                        help="fractal depth of the cracks (default: segments of about one pixel at the resolution)")
+    parser.add_argument("--cracks-per-map", default=1, type=int, metavar="K",
+                        help="number of independent cracks in every crack map (default 1)")
+    parser.add_argument("--branches", default=0, type=int, metavar="B",
+                        help="number of branches off the cracks of every crack map (default 0)")
+    parser.add_argument("--max-thickness", default=1, type=int, metavar="T",
+                        help="maximum line thickness along the crack (default 1)")
+    parser.add_argument("--dtype", default="float32", choices=["uint8", "float16", "float32"],
+                        help="dtype of the crack intensities (default float32)")
+    parser.add_argument("--normal-dtype", default="float32", choices=["float16", "float32"],
+                        help="dtype of the crack normals (default float32)")
+    parser.add_argument("--width", default=None, type=float, nargs=2, metavar=("MIN", "MAX"),
+                        help="widen the cracks with a distance transform, tapering from MIN to MAX pixels along the "
+                             "crack, instead of a random blur (default: blur)")
+    parser.add_argument("--taper", default=1.0, type=float,
+                        help="exponent of the width interpolation along the crack (default 1)")
+    parser.add_argument("--depth-exponent", default=1.0, type=float,
+                        help="shape of the crack cross-section, 1 is V-shaped, smaller values flatter (default 1)")
+    parser.add_argument("--seed", default=None, type=int, metavar="SEED",
+                        help="seed of the random number generator (default: random)")
+    return parser.parse_args(argv)
+
+
+if(__name__ == "__main__"):
+    args = parse(sys.argv[1:])
+
+    width_profile = None
+    if args.width is not None:
+        width_profile = WidthProfile(args.width[0], args.width[1], args.taper, args.depth_exponent)
+
+    depth = args.depth
+    if depth is None:
+        depth = adaptive_depth(args.resolution, num_polylines=args.cracks_per_map + args.branches)
+    print("fractal depth: " + str(depth))
+
+    write_crack_bank(args.path, args.num_cracks, args.resolution, depth, seed=args.seed,
+                     max_thickness=args.max_thickness, width_profile=width_profile,
+                     num_cracks=args.cracks_per_map, num_branches=args.branches,
+                     dtype=np.dtype(args.dtype).type, normal_dtype=np.dtype(args.normal_dtype).type)
+    print("crack bank written to " + args.path)
@@ -0,0 +1,94 @@
+# Compares the images of two runs of generate.py pass by pass, e.g. a single pass render (--single-render) against the
+# separate passes. Runs with plain python, no blender needed. Render the same samples with the same seed twice and
+# keep the first res/ directory:
+#   /path/to/blender --background --python generate.py -- --crack --seed 1 --sample-ids 0 1 2
+#   mv res res_separate
+#   /path/to/blender --background --python generate.py -- --crack --seed 1 --sample-ids 0 1 2 --single-render
+#   python utils/compare_renders.py res_separate res
+# Color and normal images are compared by their absolute difference and PSNR, ground truth masks by their intersection
+# over union and depth maps by their absolute difference where both have a surface. Renders of the same samples are
+# noisy differently, so small differences of color and normals are expected.
+import argparse
+import os
+import re
+import sys
+
+import cv2
+import numpy as np
+
+dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not dir in sys.path:
+    sys.path.append(dir)
+
+from lib.imagefiles import read_depth
+
+# files written per sample by generate.py: pass name, sample id, right camera of a stereo pair
+OUTPUT_FILE = re.compile(r'^(render|normal|gt|depth)(\d+)(_right)?\.(png|exr|npy|npz)$')
+
+
+def read_image(path):
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise IOError("could not read " + path)
+    return image
+
+
+def compare_images(a, b):
+    difference = np.abs(a.astype(np.float64) - b.astype(np.float64))
+    mse = np.mean(difference ** 2)
+    psnr = float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+    return "max diff {:.0f}, mean diff {:.3f}, PSNR {:.1f} dB".format(difference.max(), difference.mean(), psnr)
+
+
+def compare_gt(a, b):
+    a = a.reshape(a.shape[0], a.shape[1], -1).max(axis=-1) > 0
+    b = b.reshape(b.shape[0], b.shape[1], -1).max(axis=-1) > 0
+    union = np.count_nonzero(a | b)
+    iou = 1.0 if union == 0 else np.count_nonzero(a & b) / float(union)
+    return "IoU {:.4f}, {} vs {} crack pixels, {} differ".format(iou, np.count_nonzero(a), np.count_nonzero(b),
+                                                                 np.count_nonzero(a != b))
+
+
+def compare_depth(a, b):
+    # blender's OpenEXR files mark pixels without a surface with a large depth, the compact formats with inf
+    surface_a = np.isfinite(a) & (a < 1e9)
+    surface_b = np.isfinite(b) & (b < 1e9)
+    both = surface_a & surface_b
+    difference = np.abs(a[both] - b[both]) if both.any() else np.zeros(1)
+    return "max diff {:.5f}, mean diff {:.6f}, {} pixels with a surface in only one".format(
+        difference.max(), difference.mean(), np.count_nonzero(surface_a != surface_b))
+
+
+def compare(path_a, path_b, name):
+    kind = OUTPUT_FILE.match(name).group(1)
+    if kind == 'depth':
+        return compare_depth(read_depth(path_a), read_depth(path_b))
+    a, b = read_image(path_a), read_image(path_b)
+    if a.shape != b.shape:
+        return "shapes differ: {} vs {}".format(a.shape, b.shape)
+    if kind == 'gt':
+        return compare_gt(a, b)
+    return compare_images(a, b)
+
+
+def sample_key(name):
+    match = OUTPUT_FILE.match(name)
+    return int(match.group(2)), match.group(3) or '', match.group(1)
+
+
+if(__name__ == "__main__"):
+    parser = argparse.ArgumentParser(description="compare the images of two runs of generate.py")
+    parser.add_argument("first", help="res directory of the first run")
+    parser.add_argument("second", help="res directory of the second run")
+    args = parser.parse_args()
+
+    names = sorted((name for name in os.listdir(args.first) if OUTPUT_FILE.match(name)), key=sample_key)
+    if not names:
+        print("no rendered images in " + args.first)
+        sys.exit(1)
+    for name in names:
+        second = os.path.join(args.second, name)
+        if not os.path.exists(second):
+            print("{:<20} missing in {}".format(name, args.second))
+            continue
+        print("{:<20} {}".format(name, compare(os.path.join(args.first, name), second, name)))